@@ -0,0 +1,249 @@
+import io
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fatx import FATX
+from fatx.extract import extract
+from fatx.fsck import check
+from fatx.interface import DirectoryObject
+from fatx import manifest
+
+"""
+Runs one operation on many images, spread over a pool of processes.
+Every worker keeps its interpreter for all images it gets, each image is
+opened and its FAT parsed once. One JSON line per image is written as soon
+as it is done, progress and a summary go to stderr.
+"""
+
+OPERATIONS = ("list", "unpack", "hash", "fsck")
+
+
+def list_image(fs, options):
+    files = []
+    directories = [fs.root]
+    while directories:
+        for item in directories.pop().ls():
+            if isinstance(item, DirectoryObject):
+                directories.append(item)
+            files.append(
+                {
+                    "path": item.path(),
+                    "size": item._de.size,
+                    "directory": isinstance(item, DirectoryObject),
+                }
+            )
+    files.sort(key=lambda i: i["path"])
+    return {"files": files}
+
+
+def unpack_image(fs, options):
+    name = os.path.splitext(os.path.basename(options["image"]))[0]
+    dest = os.path.join(options["dest"], name)
+    os.makedirs(dest)
+    failed = []
+    files = extract(fs.root, dest, options["jobs"], failed)
+    return {"dest": dest, "files": files, "failed": failed}
+
+
+def hash_image(fs, options):
+    failed = []
+    entries = manifest.build(fs.root, options["algorithm"], options["jobs"], failed)
+    groups = manifest.duplicates(entries)
+    return {
+        "algorithm": options["algorithm"],
+        "files": [i._asdict() for i in entries],
+        "duplicates": [[i.path for i in group] for group in groups],
+        "failed": failed,
+    }
+
+
+def fsck_image(fs, options):
+    return check(fs).as_dict()
+
+
+HANDLERS = {
+    "list": list_image,
+    "unpack": unpack_image,
+    "hash": hash_image,
+    "fsck": fsck_image,
+}
+
+
+# runs in a worker process, never raises
+def process(image: str, operation: str, options: dict):
+    options = dict(options, image=image)
+    record = {"image": image, "operation": operation}
+    start = time.perf_counter()
+    # the library prints its warnings, keep them out of the results
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            with FATX.Filesystem(
+                image, options["sector_size"], options["mmap"]
+            ) as fs:
+                record["result"] = HANDLERS[operation](fs, options)
+        record["ok"] = True
+    except Exception as e:
+        record["ok"] = False
+        record["error"] = "{0}: {1}".format(type(e).__name__, e)
+    record["seconds"] = time.perf_counter() - start
+    messages = log.getvalue().splitlines()
+    if messages:
+        record["log"] = messages
+    return record
+
+
+# expands the globs of the command line and the lines of --from
+def images(patterns, listing):
+    found = []
+    if listing is not None:
+        with (sys.stdin if listing == "-" else open(listing)) as f:
+            patterns = list(patterns) + [line.strip() for line in f if line.strip()]
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        found += matches if matches else [pattern]
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Lists, unpacks, hashes or checks many images at once"
+    )
+    parser.add_argument(
+        "--sector-size",
+        dest="sector_size",
+        default=512,
+        type=int,
+        help="sector size used for the images(default: 512)",
+    )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help="memory-map the images instead of reading them cluster by cluster",
+    )
+    parser.add_argument(
+        "--processes",
+        "-P",
+        dest="processes",
+        default=os.cpu_count(),
+        type=int,
+        help="number of images processed in parallel(default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        dest="jobs",
+        default=1,
+        type=int,
+        help="threads per image for unpack and hash(default: 1)",
+    )
+    parser.add_argument(
+        "--dest",
+        dest="dest",
+        default=None,
+        type=str,
+        help="for unpack, every image is unpacked into a folder of its name in here",
+    )
+    parser.add_argument(
+        "--algorithm",
+        "-a",
+        dest="algorithm",
+        default="sha256",
+        type=str,
+        help="for hash, the hash algorithm(default: sha256)",
+    )
+    parser.add_argument(
+        "--from",
+        dest="listing",
+        default=None,
+        type=str,
+        help="file with one image path per line, - for stdin",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        dest="output",
+        default=None,
+        type=str,
+        help="write the results to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--quiet",
+        "-q",
+        dest="quiet",
+        action="store_true",
+        help="don't print the progress",
+    )
+    parser.add_argument(dest="operation", choices=OPERATIONS, help="what to do")
+    parser.add_argument(
+        dest="images",
+        type=str,
+        nargs="*",
+        action="store",
+        help="FATX filesystem images or glob patterns, e.g. 'dumps/*.img'",
+    )
+    # options may come after the operation, between it and the images
+    args = parser.parse_intermixed_args()
+
+    todo = images(args.images, args.listing)
+    if not todo:
+        sys.exit("Fatal: no images given")
+    if args.operation == "unpack":
+        if args.dest is None or not os.path.isdir(args.dest):
+            sys.exit("Fatal: unpack needs --dest, an existing directory")
+        args.dest = os.path.abspath(args.dest)
+
+    options = {
+        "sector_size": args.sector_size,
+        "mmap": args.mmap,
+        "jobs": args.jobs,
+        "dest": args.dest,
+        "algorithm": args.algorithm,
+    }
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    start = time.perf_counter()
+    # images which failed as a whole, fsck found problems in,
+    # or where single files could not be unpacked or hashed
+    failed = unclean = incomplete = 0
+    with ProcessPoolExecutor(max(1, min(args.processes, len(todo)))) as pool:
+        futures = [pool.submit(process, i, args.operation, options) for i in todo]
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            if not record["ok"]:
+                failed += 1
+            elif args.operation == "fsck" and not record["result"]["clean"]:
+                unclean += 1
+            elif record["result"].get("failed"):
+                incomplete += 1
+            if not args.quiet:
+                print(
+                    "[{0}/{1}] {2} {3} {4:.2f}s".format(
+                        done,
+                        len(todo),
+                        record["image"],
+                        "ok" if record["ok"] else record["error"],
+                        record["seconds"],
+                    ),
+                    file=sys.stderr,
+                )
+    if out is not sys.stdout:
+        out.close()
+
+    summary = "{0} images, {1} failed".format(len(todo), failed)
+    if args.operation == "fsck":
+        summary += ", {0} with problems".format(unclean)
+    if args.operation in ("unpack", "hash"):
+        summary += ", {0} incomplete".format(incomplete)
+    print(
+        "{0} in {1:.2f}s".format(summary, time.perf_counter() - start),
+        file=sys.stderr,
+    )
+    sys.exit(1 if failed or unclean or incomplete else 0)
@@ -0,0 +1,369 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from fatx import FATX
+from fatx.blocks import EntryType
+from fatx.extract import extract
+from fatx.interface import DirectoryObject
+
+"""
+Generates synthetic FATX images and times the common operations on them:
+mounting, walking the whole tree like main.py, unpacking like unpack.py,
+packing a tree into a new image like pack.py and random reads of files.
+The results are written as JSON, together with the configuration and the
+commit they were measured on, so runs of different commits can be compared.
+Images below about 1 GB are FATX16, bigger ones FATX32.
+"""
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text: str):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+# returns the size of every file to generate
+def file_sizes(count: int, distribution: str, low: int, high: int, rnd):
+    if distribution == "fixed":
+        return [high] * count
+    if distribution == "uniform":
+        return [rnd.randint(low, high) for i in range(count)]
+    if distribution == "lognormal":
+        # mostly small files with a long tail of big ones, like a game partition
+        mu = (math.log(max(1, low)) + math.log(max(1, high))) / 2
+        return [
+            min(high, max(low, int(rnd.lognormvariate(mu, 1.5))))
+            for i in range(count)
+        ]
+    raise ValueError("Unknown distribution " + distribution)
+
+
+def generate(
+    path: str,
+    size: int,
+    files: int,
+    dirs: int = 8,
+    distribution: str = "lognormal",
+    min_size: int = 1,
+    max_size: int = 1024 ** 2,
+    fragment: int = 0,
+    seed: int = 0,
+):
+    """
+    Creates an image at path with files spread over dirs directories.
+    With fragment, no file gets more than fragment consecutive clusters:
+    every (fragment + 1)th cluster is blocked while importing and freed again
+    afterwards. Returns the number of bytes imported.
+    """
+    rnd = random.Random(seed)
+    fs = FATX.Filesystem.new(size, path)
+    blocked = []
+    if fragment:
+        for cluster in range(fragment + 1, fs.fat.clusters, fragment + 1):
+            fs.fat.setEntryType(cluster, EntryType.FATX_CLUSTER_END)
+            blocked.append(cluster)
+    total = 0
+    with fs.batch():
+        for i in range(dirs):
+            fs.root.create_dir("dir{0:03d}".format(i))
+        directories = fs.root.ls() or [fs.root]
+        for i, filesize in enumerate(
+            file_sizes(files, distribution, min_size, max_size, rnd)
+        ):
+            data = bytes([i % 251]) * filesize
+            directory = directories[i % len(directories)]
+            directory.import_file("file{0:06d}.bin".format(i), data)
+            total += filesize
+        fs.fat.freeClusterChain(blocked)
+    fs.close()
+    return total
+
+
+# main.py-style walk of the whole tree, returns the number of objects
+def walk(directory):
+    count = 0
+    for item in directory.ls():
+        count += 1
+        if isinstance(item, DirectoryObject):
+            count += walk(item)
+    return count
+
+
+# pack.py-style import of a host tree, with absolute paths
+def pack(directory, src: str):
+    with os.scandir(src) as it:
+        for entry in it:
+            if entry.is_file():
+                with open(entry.path, "rb") as f:
+                    directory.import_file(entry.name, f.read())
+            else:
+                directory.create_dir(entry.name)
+                pack(directory.get(entry.name), entry.path)
+
+
+def files_of(directory):
+    for item in directory.ls():
+        if isinstance(item, DirectoryObject):
+            yield from files_of(item)
+        else:
+            yield item
+
+
+# runs func repeat times, func gets a fresh setup() result if given
+def measure(func, repeat: int, setup=None):
+    times = []
+    result = None
+    for i in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        result = func(arg)
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "runs": times,
+        "result": result,
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, workdir: str):
+    image = os.path.join(workdir, "bench.img")
+    start = time.perf_counter()
+    imported = generate(
+        image,
+        args.size,
+        args.files,
+        args.dirs,
+        args.distribution,
+        args.min_size,
+        args.max_size,
+        args.fragment,
+        args.seed,
+    )
+    results = {"generate": {"seconds": time.perf_counter() - start, "bytes": imported}}
+
+    def mount(arg):
+        FATX.Filesystem(image, use_mmap=args.mmap).close()
+
+    results["mount"] = measure(mount, args.repeat)
+
+    def mounted():
+        return FATX.Filesystem(image, use_mmap=args.mmap)
+
+    # every run starts on a freshly mounted, uncached filesystem
+    def full_walk(fs):
+        count = walk(fs.root)
+        fs.close()
+        return count
+
+    results["walk"] = measure(full_walk, args.repeat, mounted)
+
+    dest = os.path.join(workdir, "unpacked")
+
+    def fresh_dest():
+        shutil.rmtree(dest, ignore_errors=True)
+        os.mkdir(dest)
+        return mounted()
+
+    def unpack(fs):
+        count = extract(fs.root, dest, args.jobs)
+        fs.close()
+        return count
+
+    results["unpack"] = measure(unpack, args.repeat, fresh_dest)
+
+    packed = os.path.join(workdir, "packed.img")
+
+    def fresh_image():
+        if os.path.exists(packed):
+            os.remove(packed)
+        return FATX.Filesystem.new(args.size, packed)
+
+    def bulk_pack(new):
+        with new.batch():
+            pack(new.root, dest)
+        new.close()
+
+    results["pack"] = measure(bulk_pack, args.repeat, fresh_image)
+
+    fs = mounted()
+    rnd = random.Random(args.seed)
+    targets = [i for i in files_of(fs.root) if i._de.size]
+
+    def random_reads(arg):
+        done = 0
+        for i in range(args.reads):
+            obj = rnd.choice(targets)
+            offset = rnd.randrange(obj._de.size)
+            with obj.open() as f:
+                f.seek(offset)
+                done += len(f.read(args.read_size))
+        return done
+
+    results["random_reads"] = measure(random_reads, args.repeat)
+    fs.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Times the library on a generated image, results are JSON"
+    )
+    parser.add_argument(
+        "--size",
+        dest="size",
+        default="256M",
+        type=parse_size,
+        help="size of the generated partition, e.g. 512M or 8G(default: 256M)",
+    )
+    parser.add_argument(
+        "--files",
+        dest="files",
+        default=1000,
+        type=int,
+        help="number of files(default: 1000)",
+    )
+    parser.add_argument(
+        "--dirs",
+        dest="dirs",
+        default=8,
+        type=int,
+        help="number of directories the files are spread over(default: 8)",
+    )
+    parser.add_argument(
+        "--distribution",
+        dest="distribution",
+        default="lognormal",
+        choices=["fixed", "uniform", "lognormal"],
+        help="file size distribution(default: lognormal)",
+    )
+    parser.add_argument(
+        "--min-size",
+        dest="min_size",
+        default="1",
+        type=parse_size,
+        help="smallest file(default: 1)",
+    )
+    parser.add_argument(
+        "--max-size",
+        dest="max_size",
+        default="1M",
+        type=parse_size,
+        help="biggest file, the size of all files for fixed(default: 1M)",
+    )
+    parser.add_argument(
+        "--fragment",
+        dest="fragment",
+        default=0,
+        type=int,
+        help="at most this many consecutive clusters per file, 0 for none(default: 0)",
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        default=0,
+        type=int,
+        help="seed for file sizes and read offsets(default: 0)",
+    )
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        default=3,
+        type=int,
+        help="runs per benchmark(default: 3)",
+    )
+    parser.add_argument(
+        "--reads",
+        dest="reads",
+        default=1000,
+        type=int,
+        help="number of random reads per run(default: 1000)",
+    )
+    parser.add_argument(
+        "--read-size",
+        dest="read_size",
+        default="4K",
+        type=parse_size,
+        help="bytes per random read(default: 4K)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        dest="jobs",
+        default=os.cpu_count(),
+        type=int,
+        help="threads used for unpacking(default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help="memory-map the image for all reads",
+    )
+    parser.add_argument(
+        "--workdir",
+        dest="workdir",
+        default=None,
+        help="directory for the images, should be on the disk to test(default: temp)",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        dest="output",
+        default=None,
+        help="write the JSON results to this file instead of stdout",
+    )
+    args = parser.parse_args()
+
+    FATX.READ_ONLY = False
+    workdir = tempfile.mkdtemp(dir=args.workdir)
+    # the library reports every write, keep that out of the results
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        results = run(args, workdir)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(workdir)
+
+    config = dict(vars(args))
+    del config["output"], config["workdir"]
+    report = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config,
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,7 +1,23 @@
+import io
 import os
+import errno
 import math
-from .blocks import SuperBlock, FAT, DirectoryEntry, DirectoryEntryList
-from .interface import RootObject, FatxObject
+import hashlib
+import mmap
+import bisect
+import threading
+import contextlib
+from collections import OrderedDict
+from .blocks import SuperBlock, FAT, EntryType, DirectoryEntry, DirectoryEntryList
+from .cache import ClusterCache
+from .stats import Stats, timed
+from .storage import DirectReader, device_size
+from .interface import RootObject, DirectoryObject
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 """
 This file mainly contains horrible code. Please don't look to much at it.
@@ -15,6 +31,61 @@ READ_ONLY = True
 FATX16 = 2
 FATX32 = 4
 
+# number of resolved paths kept by Filesystem.lookup
+LOOKUP_CACHE_SIZE = 4096
+
+# default number of bytes of clusters kept in memory by Filesystem
+CLUSTER_CACHE_SIZE = 8 * 1024 * 1024
+
+# size of the buffer used to copy files out, if the kernel can't do it
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# errors telling that a copy method does not work for these two files
+_FALLBACK_ERRNOS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF)
+# copy methods the kernel does not implement at all
+_unsupported = set()
+# one copy buffer per thread
+_buffers = threading.local()
+
+
+def _copy_file_range(src: int, dst: int, offset: int, size: int):
+    return os.copy_file_range(src, dst, size, offset)
+
+
+def _sendfile(src: int, dst: int, offset: int, size: int):
+    return os.sendfile(dst, src, offset, size)
+
+
+def _copy_buffer():
+    if not hasattr(_buffers, "buffer"):
+        _buffers.buffer = bytearray(COPY_CHUNK_SIZE)
+    return _buffers.buffer
+
+
+def _pread_into(src: int, view, offset: int):
+    if hasattr(os, "preadv"):
+        return os.preadv(src, [view], offset)
+    data = os.pread(src, len(view), offset)
+    view[: len(data)] = data
+    return len(data)
+
+
+# returns a new hash object, any hashlib algorithm or,
+# if the xxhash package is installed, one of its (xxh64, xxh3_64, xxh128...)
+def new_hasher(algorithm: str):
+    if algorithm.startswith("xxh"):
+        if xxhash is None:
+            raise ValueError(algorithm + " needs the xxhash package")
+        if not hasattr(xxhash, algorithm):
+            raise ValueError("Unknown hash algorithm " + algorithm)
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+for _name, _method in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile)):
+    if not hasattr(os, _name):
+        _unsupported.add(_method)
+
 
 def writing_warning(func):
     def call(*args, **kwargs):
@@ -23,90 +94,291 @@ def writing_warning(func):
             return func(*args, **kwargs)
         else:
             print("Skip saving changes to disk, change READ_ONLY to False")
+            args[0]._stats.count("skipped_writes")
             return None
 
     return call
 
 
 class Filesystem:
-    def __init__(self, file: str, sector_size: int = 512):
-        self.f = open(file, "r+b")
-        self.sb = SuperBlock(self.f.read(SuperBlock.SUPERBLOCK_SIZE), sector_size)
+    def __init__(
+        self,
+        file: str,
+        sector_size: int = 512,
+        use_mmap: bool = False,
+        cache_size: int = CLUSTER_CACHE_SIZE,
+        direct: bool = False,
+    ):
+        if use_mmap and direct:
+            raise ValueError("An image can either be mmap'ed or read directly")
+        # unbuffered, so that writes are visible to the mapping right away.
+        # Nothing is written while READ_ONLY is set, so read-only devices
+        # and dumps can be opened then
+        self.f = open(file, "rb" if READ_ONLY else "r+b", buffering=0)
+        # stat reports 0 bytes for block devices, ask the device itself
+        size = device_size(self.f.fileno())
+        self._mm = None
+        self._view = None
+        # O_DIRECT reader, bypassing the page cache for all reads
+        self._direct = None
+        # clusters recently read, a mapped image is its own cache
+        self.cache = None
+        if use_mmap:
+            # the mapping is only ever read, all writes still go through self.f
+            self._mm = mmap.mmap(self.f.fileno(), size, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mm)
+        elif cache_size:
+            self.cache = ClusterCache(cache_size)
+        if direct:
+            self._direct = DirectReader(file)
+        # directory lists waiting for the end of a batch, by cluster
+        self._pending = None
+        # path -> FatxObject, least recently used first
+        self._lookups = OrderedDict()
+        # I/O counters and timings, see stats()
+        self._stats = Stats()
+
+        self.sb = SuperBlock(self._read(0, SuperBlock.SUPERBLOCK_SIZE), sector_size)
 
-        self.fat_size = self._calc_fat_size(os.stat(file).st_size, self.sb.cluster_size)
-        self.fat = FAT(self.f.read(self.fat_size))
-
-        # Sadly, sometimes the interfaces need to access the filesystem
-        FatxObject.registerFilesystem(self)
+        self.fat_size = self._calc_fat_size(size, self.sb.cluster_size)
+        self.fat = FAT(
+            self._read(SuperBlock.SUPERBLOCK_SIZE, self.fat_size),
+            self._calc_cluster_count(size),
+        )
 
-        # Read the first(yes, 1, not zero) Cluster,
+        # Read the first(yes, 1, not zero) Cluster and the rest of its chain,
         # it should contain the root DirectoryEntry list
-        cluster = self._get_cluster(1)
-        self.root = RootObject(DirectoryEntryList(cluster, 1))
+        self.root = RootObject(DirectoryEntryList(self._read_directory(1), 1), self)
 
     @classmethod
-    def new(cls, size: int, file: str, sector_size: int = 512):
+    def new(
+        cls,
+        size: int,
+        file: str,
+        sector_size: int = 512,
+        cache_size: int = CLUSTER_CACHE_SIZE,
+    ):
         self = cls.__new__(cls)
-        self.f = open(file, "w+b")
+        self.f = open(file, "w+b", buffering=0)
+        self._mm = None
+        self._view = None
+        self._direct = None
+        self.cache = ClusterCache(cache_size) if cache_size else None
+        self._pending = None
+        self._lookups = OrderedDict()
+        self._stats = Stats()
 
         self.sb = SuperBlock.new(sector_size)
         self.fat_size = self._calc_fat_size(size, self.sb.cluster_size)
-        self.fat = FAT.new(self.fat_size)
+        self.fat = FAT.new(self.fat_size, self._calc_cluster_count(size))
         root_dl = DirectoryEntryList(b"\xFF" * 64, 1)
 
-        self.f.write(self.sb.pack())
-        self.f.write(self.fat.pack())
-        self.f.write(b"\x00" * (size - self.fat_size - SuperBlock.SUPERBLOCK_SIZE))
+        # Everything but the superblock, the first page of the FAT and the
+        # root directory is zero, so the file is left sparse and only those
+        # are written. Unwritten parts read back as zeros.
+        self.f.truncate(size)
+        self._write(0, self.sb.pack())
+        for offset, data in self.fat.packDirty():
+            self._write(SuperBlock.SUPERBLOCK_SIZE + offset, data)
         self._write_directory_list(root_dl)
 
-        FatxObject.registerFilesystem(self)
-
-        cluster = self._get_cluster(1)
-        self.root = RootObject(DirectoryEntryList(cluster, 1))
+        self.root = RootObject(root_dl, self)
         return self
 
+    def lookup(self, path: str):
+        """
+        Returns the FatxObject at an absolute path like "/a/b/c.xbe".
+        Every directory on the way is searched through its name index and
+        resolved paths are cached, so repeated lookups are cheap.
+        Raises IndexError if the path does not exist.
+        """
+        names = [name for name in path.split("/") if name]
+        obj = self._lookup(names)
+        if obj is not self.root and obj._de.deleted:
+            raise IndexError(path)
+        return obj
+
+    def _lookup(self, names):
+        if not names:
+            return self.root
+        key = "/" + "/".join(names)
+        obj = self._lookups.get(key)
+        if obj is not None:
+            self._lookups.move_to_end(key)
+            return obj
+        parent = self._lookup(names[:-1])
+        if not isinstance(parent, DirectoryObject) or (
+            parent is not self.root and parent._de.deleted
+        ):
+            raise IndexError(key)
+        obj = parent.get(names[-1])
+        # a deleted entry may be replaced under the same name
+        if obj._de.deleted:
+            return obj
+        self._lookups[key] = obj
+        if len(self._lookups) > LOOKUP_CACHE_SIZE:
+            self._lookups.popitem(last=False)
+        return obj
+
+    # drops a path and everything below it from the lookup cache
+    def _forget_path(self, path: str):
+        if not self._lookups:
+            return
+        below = path.rstrip("/") + "/"
+        for key in [k for k in self._lookups if k == path or k.startswith(below)]:
+            del self._lookups[key]
+
     # returns a DirectoryEntryList from the cluster assosiated in the given directoryentry
     def open_directory(self, de: DirectoryEntry):
-        assert de.atr.DIRECTORY
-        cluster = self._get_cluster(de.cluster)
+        assert de.is_directory
+        # not on disk yet, it was created in the running batch
+        if self._pending is not None and de.cluster in self._pending:
+            return self._pending[de.cluster]
         try:
-            return DirectoryEntryList(cluster, de.cluster)
+            return DirectoryEntryList(self._read_directory(de.cluster), de.cluster)
         except SystemError as e:
             print(e)
             self._print_debug(de)
             return None
 
     # Reads a File and returns it
+    @timed("read_file")
     def read_file(self, de: DirectoryEntry):
-        data = bytearray()
-        if de.atr.DIRECTORY:
+        if de.is_directory:
             raise ValueError("This is a directory, not a file")
+        # small files are served from the cache, like directories
+        if self.cache is not None and 0 < de.size <= self.sb.cluster_size:
+            return bytearray(self._get_cluster(de.cluster)[: de.size])
+        data = bytearray(de.size)
+        done = 0
         try:
-            clusters = self.fat.clusterChain(de.cluster)
-            for i in clusters:
-                data += self._get_cluster(i)
-            return data[: de.size]
+            # one read per contiguous run of clusters, straight into data
+            with memoryview(data) as view:
+                for offset, size in self._file_runs(de, complete=False):
+                    self._readinto(offset, view[done : done + size])
+                    done += size
+            if done < de.size:
+                raise SystemError("Cluster chain is shorter than the file")
+            return data
         except Exception as e:
             print(e)
             self._print_debug(de)
-            print("\tread {0} from {1} bytes".format(len(data), de.size))
-            return data
+            print("\tread {0} from {1} bytes".format(done, de.size))
+            return data[:done]
+
+    # Writes a file to the host file descriptor fd, at its current position.
+    # Every run of clusters is copied inside the kernel where possible, only
+    # positional reads are used, so it is safe to call from many threads
+    @timed("export_file")
+    def export_file(self, de: DirectoryEntry, fd: int):
+        if de.is_directory:
+            raise ValueError("This is a directory, not a file")
+        for offset, size in self._file_runs(de):
+            self._copy_out(offset, size, fd)
+
+    # copies size bytes at offset of the image to fd, trying
+    # copy_file_range, then sendfile, then a reused buffer
+    @timed("copy")
+    def _copy_out(self, offset: int, size: int, fd: int):
+        self._stats.count("copies")
+        self._stats.count("copy_bytes", size)
+        if self._direct is not None:
+            return self._direct.copy_to(offset, size, fd)
+        src = self.f.fileno()
+        for method in (_copy_file_range, _sendfile):
+            if method in _unsupported:
+                continue
+            try:
+                while size > 0:
+                    n = method(src, fd, offset, size)
+                    if n == 0:
+                        raise SystemError("Unexpected end of image", offset)
+                    offset += n
+                    size -= n
+                return
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+                if e.errno in (errno.ENOSYS, errno.EOPNOTSUPP):
+                    _unsupported.add(method)
+
+        if self._view is not None:
+            with self._view[offset : offset + size] as view:
+                while len(view):
+                    view = view[os.write(fd, view) :]
+            return
+        buffer = _copy_buffer()
+        while size > 0:
+            with memoryview(buffer)[: min(size, len(buffer))] as view:
+                n = _pread_into(src, view, offset)
+                if n == 0:
+                    raise SystemError("Unexpected end of image", offset)
+                with view[:n] as chunk:
+                    while len(chunk):
+                        chunk = chunk[os.write(fd, chunk) :]
+            offset += n
+            size -= n
+
+    # Returns the hex digest of a file, its clusters are streamed through the
+    # hasher without reading the whole file. Safe to call from many threads
+    @timed("hash_file")
+    def hash_file(self, de: DirectoryEntry, algorithm: str = "sha256"):
+        if de.is_directory:
+            raise ValueError("This is a directory, not a file")
+        hasher = new_hasher(algorithm)
+        for offset, size in self._file_runs(de):
+            self._feed(offset, size, hasher.update)
+        return hasher.hexdigest()
+
+    # passes size bytes at offset of the image to consume, chunk by chunk,
+    # using positional reads and a buffer per thread
+    def _feed(self, offset: int, size: int, consume):
+        self._stats.count("reads")
+        self._stats.count("read_bytes", size)
+        if self._view is not None:
+            with self._view[offset : offset + size] as view:
+                consume(view)
+            return
+        buffer = _copy_buffer()
+        while size > 0:
+            with memoryview(buffer)[: min(size, len(buffer))] as view:
+                if self._direct is not None:
+                    n = self._direct.readinto(offset, view)
+                else:
+                    n = _pread_into(self.f.fileno(), view, offset)
+                if n == 0:
+                    raise SystemError("Unexpected end of image", offset)
+                with view[:n] as chunk:
+                    consume(chunk)
+            offset += n
+            size -= n
+
+    # Returns a buffered, seekable file object streaming the file's clusters
+    def open_file(self, de: DirectoryEntry):
+        if de.is_directory:
+            raise ValueError("This is a directory, not a file")
+        return io.BufferedReader(FileReader(self, de), self.sb.cluster_size)
 
     def rename_object(self, de: DirectoryEntry, name: str):
-        de.rename(name)
+        de.origin.rename(de, name)
         self._write_directory_entry(de)
 
     def create_folder(self, dl: DirectoryEntryList, name: str):
         de = DirectoryEntry.new_entry(name, dl)
         de.atr.DIRECTORY = True
-        dl.append(de)
+        # like import_file, nothing is left behind if the image is full
+        if dl.get(de.filename) is not None:
+            raise ValueError(de.filename + " already exists")
         chain = self.fat.getFreeClusterChain(1)
+        dl.append(de)
         de.cluster = chain[0]
         new_dl = DirectoryEntryList(b"\xFF" * 64, chain[0])
 
         self.fat.linkClusterChain(chain)
         self._write_directory_list(dl)
         self._write_directory_list(new_dl)
+        self._write_fat()
+        return de
 
     def import_file(self, dl: DirectoryEntryList, name: str, data: bytes):
         de = DirectoryEntry.new_entry(name, dl)
@@ -114,51 +386,313 @@ class Filesystem:
         # get a clusterchain(=list of free clusters we can write onto)
         # number of clusters needed to store a file size n
         nclusters = math.ceil(float(de.size) / float(self.sb.cluster_size))
-        chain = self.fat.getFreeClusterChain(nclusters)
-        de.cluster = chain[0]
+        # a duplicate name must not take clusters out of the index,
+        # a full image must not leave an entry without clusters behind
+        if dl.get(de.filename) is not None:
+            raise ValueError(de.filename + " already exists")
+        # empty files have no clusters at all
+        chain = self.fat.getFreeClusterChain(nclusters) if nclusters else None
         dl.append(de)
-
-        self.fat.linkClusterChain(chain)
-        self._write_data(chain, data)
+        if chain:
+            de.cluster = chain[0]
+            self.fat.linkClusterChain(chain)
+            self._write_data(chain, data)
         self._write_directory_list(dl)
-        # ToDo: very inefficient, needs to be redone
         self._write_fat()
+        return de
+
+    # Overwrites the content of a file. The chain is cut or extended to the
+    # new size, so only the clusters of the new data are written
+    def replace_file(self, de: DirectoryEntry, data: bytes):
+        if de.is_directory:
+            raise ValueError("This is a directory, not a file")
+        nclusters = math.ceil(float(len(data)) / float(self.sb.cluster_size))
+        chain = self.fat.clusterChain(de.cluster) if de.cluster else []
+        if nclusters < len(chain):
+            self.fat.freeClusterChain(chain[nclusters:])
+            chain = chain[:nclusters]
+            if chain:
+                self.fat.setEntryType(chain[-1], EntryType.FATX_CLUSTER_END)
+        elif nclusters > len(chain):
+            extension = self.fat.getFreeClusterChain(nclusters - len(chain))
+            if chain:
+                self.fat.extendClusterChain(chain, extension)
+            else:
+                self.fat.linkClusterChain(extension)
+            chain = chain + extension
+        de.cluster = chain[0] if chain else 0
+        de.size = len(data)
+        if chain:
+            self._write_data(chain, data)
+        self._write_fat()
+        self._write_directory_entry(de)
+        return de
 
+    # Marks an entry as deleted, with clean its clusters are freed as well.
+    # The clusters of a directory are freed, but not the ones of its content
     def delete_file(self, de: DirectoryEntry, clean=False):
-        de.atr.DELETED = True
+        de.origin.delete(de)
+        if clean and de.cluster:
+            self.fat.freeClusterChain(self.fat.clusterChain(de.cluster))
+            if self._pending is not None:
+                self._pending.pop(de.cluster, None)
+            self._write_fat()
         self._write_directory_entry(de)
 
+    @contextlib.contextmanager
+    def batch(self, fsync: bool = False):
+        """
+        Defers writing the FAT and directory lists until the block is left,
+        file data is still written right away. Every directory list is then
+        written once, after the FAT, so no entry ever points to clusters
+        that are free on disk. Pending changes are written even if the
+        block raises, everything done before the error is kept.
+        Nested batches are merged into the outermost one.
+        """
+        if self._pending is not None:
+            yield self
+            return
+        self._pending = {}
+        try:
+            yield self
+        finally:
+            pending = self._pending
+            self._pending = None
+            self._write_fat()
+            for dl in pending.values():
+                self._write_directory_list(dl)
+            if fsync:
+                self._fsync()
+
     def status(self):
         print(self.__str__())
 
+    def stats(self):
+        """
+        Returns the I/O counters, the hits and misses of the cluster cache
+        and, if timing was turned on with trace(), a histogram of the
+        durations of every operation
+        """
+        stats = self._stats.as_dict()
+        if self.cache is not None:
+            stats["counters"]["cache_hits"] = self.cache.hits
+            stats["counters"]["cache_misses"] = self.cache.misses
+        return stats
+
+    def trace(self, hook=None, enabled: bool = True):
+        """
+        Turns on timing of the I/O operations, hook(operation, seconds) is
+        called after each of them if given. trace(enabled=False) turns
+        timing off again, the collected timings are kept.
+        """
+        self._stats.timing = enabled
+        self._stats.hook = hook if enabled else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # the image file is closed even if views of the mapping are still
+        # held somewhere, closing the mapping raises BufferError then
+        try:
+            if self._mm is not None:
+                view, mm = self._view, self._mm
+                self._view = None
+                self._mm = None
+                view.release()
+                mm.close()
+        finally:
+            if self._direct is not None:
+                self._direct.close()
+                self._direct = None
+            self.f.close()
+
     def _write_directory_entry(self, de: DirectoryEntry):
-        # ToDo: Reduce to writing this single DirectoryEntry
-        # i.e. position_of_de * de_size + base_address
+        # only the cluster holding this entry is written
+        de.origin.touch(de)
         self._write_directory_list(de.origin)
 
-    @writing_warning
     def _write_directory_list(self, dl: DirectoryEntryList):
-        self.f.seek(self._cluster_id_offset(dl.cluster))
-        data = dl.pack()
+        # Directories grow by whole clusters as they fill up,
+        # there always has to be room for the terminating entry.
+        needed = math.ceil(
+            (len(dl.list()) + 1) * DirectoryEntry.DIRECTORY_SIZE / self.sb.cluster_size
+        )
+        chain = self.fat.clusterChain(dl.cluster)
+        if needed > len(chain):
+            extension = self.fat.getFreeClusterChain(needed - len(chain))
+            self.fat.extendClusterChain(chain, extension)
+            self._write_fat()
+        if self._pending is not None:
+            self._pending[dl.cluster] = dl
+        else:
+            self._store_directory_list(dl)
+
+    def _write_fat(self):
+        if self._pending is None:
+            self._store_fat()
+
+    @writing_warning
+    @timed("fsync")
+    def _fsync(self):
+        self._stats.count("fsyncs")
+        os.fsync(self.f.fileno())
+
+    @writing_warning
+    @timed("write_directory_list")
+    def _store_directory_list(self, dl: DirectoryEntryList):
+        self._stats.count("directory_flushes")
+        # start at the cluster holding the first changed entry
+        per_cluster = self.sb.cluster_size // DirectoryEntry.DIRECTORY_SIZE
+        first = (dl.first_changed or 0) // per_cluster
+        dl.first_changed = None
+        data = dl.pack(first * per_cluster)
         # add padding
-        data += (self.sb.cluster_size - len(data)) * b"\xFF"
-        self.f.write(data)
+        if len(data) % self.sb.cluster_size:
+            data += (self.sb.cluster_size - len(data) % self.sb.cluster_size) * b"\xFF"
+        chain = self.fat.clusterChain(dl.cluster)
+        chain = chain[first : first + len(data) // self.sb.cluster_size]
+        self._write_clusters(chain, data)
 
     @writing_warning
-    def _write_fat(self):
-        self.f.seek(SuperBlock.SUPERBLOCK_SIZE)
-        self.f.write(self.fat.pack())
+    @timed("write_fat")
+    def _store_fat(self):
+        self._stats.count("fat_flushes")
+        # only the pages changed since the last write
+        for offset, data in self.fat.packDirty():
+            self._write(SuperBlock.SUPERBLOCK_SIZE + offset, data)
 
     @writing_warning
+    @timed("write_data")
     def _write_data(self, clusterchain: [int], data):
-        for i in clusterchain:
-            self.f.seek(self._cluster_id_offset(i))
-            self.f.write(data[: self.sb.cluster_size])
-            data = data[self.sb.cluster_size:]
-
+        self._write_clusters(clusterchain, data)
+
+    def _write_clusters(self, clusterchain: [int], data):
+        # write-through, cached copies of these clusters are outdated now
+        if self.cache is not None:
+            for i in clusterchain:
+                self.cache.invalidate(i)
+        # one write per contiguous run of clusters
+        done = 0
+        with memoryview(data) as view:
+            for start, length in self.fat.chainExtents(clusterchain):
+                size = length * self.sb.cluster_size
+                self._write(self._cluster_id_offset(start), view[done : done + size])
+                done += size
+
+    @timed("write")
+    def _write(self, offset: int, data):
+        self._stats.count("seeks")
+        self.f.seek(offset)
+        with memoryview(data) as view:
+            while len(view):
+                n = self.f.write(view)
+                self._stats.count("writes")
+                self._stats.count("write_bytes", n)
+                view = view[n:]
+
+    # Returns the (offset in image, number of bytes) runs holding the
+    # content of a file, one for every contiguous run of its clusters.
+    # Raises SystemError if the chain is too short for the size of the file,
+    # unless complete is False, then the runs of what is there are returned
+    def _file_runs(self, de: DirectoryEntry, complete: bool = True):
+        runs = []
+        remaining = de.size
+        if remaining == 0:
+            return runs
+        for start, length in self.fat.clusterExtents(de.cluster):
+            size = min(length * self.sb.cluster_size, remaining)
+            runs.append((self._cluster_id_offset(start), size))
+            remaining -= size
+            if remaining == 0:
+                break
+        if remaining and complete:
+            raise SystemError(
+                "Cluster chain is {0} bytes shorter than the file".format(remaining)
+            )
+        return runs
+
+    # Reads a directory list starting at cluster ID. If its chain is broken
+    # in the FAT, only the first cluster is read, like before directories
+    # could span several clusters, so a damaged FAT still lists what it can
+    def _read_directory(self, ID: int):
+        try:
+            return self._read_chain(ID)
+        except (ValueError, SystemError) as e:
+            print(e, "at directory cluster", ID)
+            return self._get_cluster(ID)
+
+    # Returns the content of a whole cluster chain, as one memoryview if
+    # the image is mmap'ed and the chain is contiguous
+    def _read_chain(self, ID: int):
+        if self.cache is not None:
+            chain = self.fat.clusterChain(ID)
+            if len(chain) == 1:
+                return self._get_cluster(ID)
+            return b"".join([self._get_cluster(i) for i in chain])
+        runs = [
+            (self._cluster_id_offset(start), length * self.sb.cluster_size)
+            for start, length in self.fat.clusterExtents(ID)
+        ]
+        if len(runs) == 1:
+            return self._read(*runs[0])
+        return b"".join([bytes(self._read(offset, size)) for offset, size in runs])
+
+    # Returns a cluster, either as bytes or, when mmap'ed, as a zero-copy memoryview
+    @timed("get_cluster")
     def _get_cluster(self, ID: int):
-        self.f.seek(self._cluster_id_offset(ID))
-        return self.f.read(self.sb.cluster_size)
+        if self.cache is None:
+            return self._read(self._cluster_id_offset(ID), self.sb.cluster_size)
+        data = self.cache.get(ID)
+        if data is None:
+            data = self._read(self._cluster_id_offset(ID), self.sb.cluster_size)
+            self.cache.put(ID, data)
+        return data
+
+    # Fills buffer with the bytes at offset, returns less only at the end of the image.
+    # Reads are positional, so files can be read by many threads at once
+    @timed("read")
+    def _readinto(self, offset: int, buffer):
+        self._stats.count("reads")
+        if self._direct is not None:
+            done = self._direct.readinto(offset, buffer)
+        elif self._view is not None:
+            chunk = self._view[offset : offset + len(buffer)]
+            buffer[: len(chunk)] = chunk
+            done = len(chunk)
+        else:
+            done = 0
+            with memoryview(buffer) as view:
+                while done < len(view):
+                    n = _pread_into(self.f.fileno(), view[done:], offset + done)
+                    if not n:
+                        break
+                    done += n
+        self._stats.count("read_bytes", done)
+        return done
+
+    @timed("read")
+    def _read(self, offset: int, size: int):
+        self._stats.count("reads")
+        if self._direct is not None:
+            data = self._direct.read(offset, size)
+        elif self._view is not None:
+            data = self._view[offset : offset + size]
+        else:
+            chunks = []
+            while size > 0:
+                chunk = os.pread(self.f.fileno(), size, offset)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                offset += len(chunk)
+                size -= len(chunk)
+            data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+        self._stats.count("read_bytes", len(data))
+        return data
 
     # Calculates the offset for a given clusterID
     def _cluster_id_offset(self, ID: int):
@@ -182,6 +716,12 @@ class Filesystem:
             fat_size += 4096 - fat_size % 4096
         return int(fat_size)
 
+    # Number of FAT entries backed by a cluster of the partition,
+    # entry 0 has none, the data clusters are numbered from 1
+    def _calc_cluster_count(self, partition_size: int):
+        data_size = partition_size - SuperBlock.SUPERBLOCK_SIZE - self.fat_size
+        return data_size // self.sb.cluster_size + 1
+
     def _print_debug(self, de: DirectoryEntry):
         print("\tName: {0}".format(de.filename))
         print("\tCluster ID: {0}".format(de.cluster))
@@ -193,3 +733,62 @@ class Filesystem:
 
     def __str__(self):
         return "{0} ~ {1}".format(str(self.sb), str(self.fat))
+
+
+class FileReader(io.RawIOBase):
+    """
+    Raw, read-only stream over the clusters of a single file.
+    Offsets are mapped onto the cluster chain of the file, so only the
+    requested bytes are read from the image no matter how big the file is.
+    Wrap it in an io.BufferedReader (or use Filesystem.open_file).
+    """
+
+    def __init__(self, fs: Filesystem, de: DirectoryEntry):
+        super().__init__()
+        self._fs = fs
+        self._size = de.size
+        self._pos = 0
+        self._runs = fs._file_runs(de)
+        # file offset at which each run starts
+        self._starts = []
+        start = 0
+        for offset, size in self._runs:
+            self._starts.append(start)
+            start += size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError("Invalid whence ({0})".format(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position {0}".format(pos))
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._size - self._pos)
+        if n <= 0:
+            return 0
+        index = bisect.bisect_right(self._starts, self._pos) - 1
+        offset, size = self._runs[index]
+        skip = self._pos - self._starts[index]
+        # never read across the end of a run, the next one may be anywhere
+        n = min(n, size - skip)
+        with memoryview(buffer) as view:
+            n = self._fs._readinto(offset + skip, view[:n])
+        self._pos += n
+        return n
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .FATX import Filesystem
+from .interface import DirectoryObject, FileObject
+
+"""
+An asyncio facade for reading FATX images.
+Every blocking call into Filesystem runs in a thread pool, so the event loop
+never waits for the disk. A semaphore bounds the number of calls a single
+image has in flight, and one pool can be shared by many images, so a
+service can bound its total number of I/O threads as well.
+File contents are read with positional reads and may be read by many
+threads at once. Directories are loaded lazily and cached by the objects
+of the tree, so everything touching the tree holds a lock per image.
+"""
+
+# default number of calls in flight per image
+DEFAULT_LIMIT = 8
+# default size of the chunks yielded by AsyncFilesystem.chunks
+CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncFilesystem:
+    def __init__(self, fs: Filesystem, executor=None, limit: int = DEFAULT_LIMIT):
+        self.fs = fs
+        # a pool of our own is shut down by close, a shared one is left alone
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(limit)
+        self._limit = limit
+        # Created on first use. Before Python 3.10 a semaphore is bound to
+        # the loop current when it is created, which need not be the one
+        # this object is used from.
+        self._semaphore = None
+        # held while the directory tree or the lookup cache is used
+        self._tree = threading.Lock()
+
+    @classmethod
+    async def open(
+        cls, file: str, *args, executor=None, limit: int = DEFAULT_LIMIT, **kwargs
+    ):
+        """
+        Opens an image without blocking, the arguments are those of Filesystem
+        """
+        loop = asyncio.get_running_loop()
+        fs = await loop.run_in_executor(
+            executor, lambda: Filesystem(file, *args, **kwargs)
+        )
+        return cls(fs, executor, limit)
+
+    @property
+    def root(self):
+        return self.fs.root
+
+    async def alookup(self, path: str):
+        """
+        returns the FatxObject at path, see Filesystem.lookup
+        """
+        return await self._run(self._locked, self.fs.lookup, path)
+
+    async def als(self, directory: DirectoryObject, deleted: bool = False):
+        """
+        returns the list of objects in directory, see DirectoryObject.ls
+        """
+        return await self._run(self._locked, directory.ls, deleted)
+
+    async def iterdir(self, directory: DirectoryObject, deleted: bool = False):
+        """
+        async for obj in afs.iterdir(directory): ...
+        """
+        for obj in await self.als(directory, deleted):
+            yield obj
+
+    async def walk(self, directory: DirectoryObject = None):
+        """
+        yields every object below directory(default: root), depth first
+        """
+        async for obj in self.iterdir(directory or self.fs.root):
+            yield obj
+            if isinstance(obj, DirectoryObject):
+                async for child in self.walk(obj):
+                    yield child
+
+    async def aread(self, obj: FileObject):
+        """
+        returns all bytes of a file
+        """
+        return await self._run(obj.export)
+
+    async def chunks(self, obj: FileObject, size: int = CHUNK_SIZE):
+        """
+        async for chunk in afs.chunks(file): ... streams a file in chunks
+        of at most size bytes, only one chunk is in memory at a time
+        """
+        reader = await self._run(obj.open)
+        try:
+            while True:
+                chunk = await self._run(reader.read, size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            reader.close()
+
+    async def aexport_to(self, obj: FileObject, path_or_fd):
+        """
+        copies a file to a host path or file descriptor, see FileObject.export_to
+        """
+        return await self._run(obj.export_to, path_or_fd)
+
+    async def adigest(self, obj: FileObject, algorithm: str = "sha256"):
+        """
+        returns the hash of a file, see FileObject.digest
+        """
+        return await self._run(obj.digest, algorithm)
+
+    async def close(self):
+        await self._run(self.fs.close)
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _run(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._limit)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    def _locked(self, func, *args):
+        with self._tree:
+            return func(*args)
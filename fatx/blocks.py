@@ -1,7 +1,14 @@
 #!/bin/env python3
+import re
+import sys
+import bisect
+import heapq
 import struct
+import threading
+from collections import OrderedDict
 import enum
 import random
+from array import array
 from typing import List
 
 
@@ -80,25 +87,52 @@ class FAT:
     |0xfff8 - 0xffff| Marks the end of a cluster chain
     """
 
-    def __init__(self, raw_clustermap):
-        self.f = raw_clustermap
+    # the FAT is written back in pages of this size
+    PAGE_SIZE = 4096
+    # number of chains memoized by clusterExtents
+    CHAIN_CACHE_SIZE = 4096
+
+    def __init__(self, raw_clustermap, clusters: int = None):
         # number of bytes per cluster entry
         # usually 2(FATX16) or 4(FATX32) bytes
         self.size = 2 if len(raw_clustermap) < (0xFFF5 * 2) else 4
-        self.clustermap = []
 
-        # ToDo use memory view for zerocopy magic
-        # slice up the fat table
-        while len(self.f) > 0:
-            entry = int.from_bytes(self.f[: self.size], "little")
-            self.f = self.f[self.size :]
-            self.clustermap.append(entry)
+        # decode the whole table in one pass into a typed array,
+        # raw_clustermap may be any bytes-like object (bytes, mmap, memoryview)
+        self.clustermap = array(self._typecode(self.size))
+        self.clustermap.frombytes(raw_clustermap)
+        if sys.byteorder != "little":
+            self.clustermap.byteswap()
+        self._setup(clusters)
 
         if self.size == 2:
             assert 0xFFF8 == self.clustermap[0]
         else:
             assert 0xFFFFFFF8 == self.clustermap[0]
 
+    def _setup(self, clusters):
+        # The table is padded to whole pages, entries from here on
+        # have no cluster on the partition and are never allocated
+        self.clusters = len(self.clustermap)
+        if clusters is not None:
+            self.clusters = min(clusters, self.clusters)
+        # entry value marking a bad cluster, everything above ends a chain
+        self._bad = 0xFFF7 if self.size == 2 else 0xFFFFFFF7
+        # index of the free clusters, built on the first allocation
+        self._free = None
+        # pages modified since the last pack
+        self._dirty = set()
+        # memoized extents of recently walked chains
+        self._chains = ChainCache(self.CHAIN_CACHE_SIZE)
+
+    # returns the array typecode whose items are exactly size bytes wide
+    @staticmethod
+    def _typecode(size):
+        for code in ("H", "I", "L"):
+            if array(code).itemsize == size:
+                return code
+        raise SystemError("No array type with " + str(size) + " bytes per item")
+
     def numberClusters(self):
         return len(self.clustermap)
 
@@ -107,16 +141,10 @@ class FAT:
             return EntryType.FATX_CLUSTER_AVAILABLE
         if entry == 0x0001:
             return EntryType.FATX_CLUSTER_RESERVED
-        if self.size == 2:
-            if entry == 0xFFF7:
-                return EntryType.FATX_CLUSTER_BAD
-            if entry > 0xFFF7:
-                return EntryType.FATX_CLUSTER_END
-        else:
-            if entry == 0xFFFFFFF7:
-                return EntryType.FATX_CLUSTER_BAD
-            if entry > 0xFFFFFFF7:
-                return EntryType.FATX_CLUSTER_END
+        if entry == self._bad:
+            return EntryType.FATX_CLUSTER_BAD
+        if entry > self._bad:
+            return EntryType.FATX_CLUSTER_END
         return EntryType.FATX_CLUSTER_DATA
 
     # Warning: Ugly code ahead!
@@ -154,89 +182,404 @@ class FAT:
                     == EntryType.FATX_CLUSTER_AVAILABLE
                 )
                 t = entrytype
+        old = self.clustermap[pos]
         self.clustermap[pos] = t
+        # free clusters are never part of a memoized chain
+        if old != 0x0000:
+            self._chains.forget(pos)
+        self._dirty.add(pos * self.size // self.PAGE_SIZE)
+        # keep the free space index in sync
+        if self._free is not None:
+            if t == 0x0000 and old != 0x0000:
+                self._free.release(pos)
+            elif t != 0x0000 and old == 0x0000:
+                self._free.discard(pos)
 
     # collects the IDs/No. of clusters of a chain of a given start cluster
     def clusterChain(self, pointer):
-        l = []
-        l.append(pointer)
-
+        return [
+            cluster
+            for start, length in self.clusterExtents(pointer)
+            for cluster in range(start, start + length)
+        ]
+
+    # same as clusterChain, but coalesced into (start cluster, run length)
+    # extents. Chains are memoized until one of their clusters changes.
+    def clusterExtents(self, pointer):
+        extents = self._chains.get(pointer)
+        if extents is None:
+            extents = self._walkChain(pointer)
+            self._chains.put(pointer, extents)
+        return list(extents)
+
+    def _walkChain(self, pointer):
+        clustermap = self.clustermap
+        bad = self._bad
         # Your first pointer should always point to either the next
-        # clusterchain element or mark the end of a chain
-        nvalue = self.getEntryType(self.clustermap[pointer])
-        if nvalue not in [EntryType.FATX_CLUSTER_DATA, EntryType.FATX_CLUSTER_END]:
+        # clusterchain element or mark the end of a chain.
+        # Plain integer compares: 0 and 1 are free/reserved, bad is bad,
+        # everything above bad ends the chain, everything below points on
+        value = clustermap[pointer]
+        if value <= 0x0001 or value == bad:
             raise ValueError("Start cluster is not part of a chain")
 
+        extents = []
+        start, length = pointer, 1
+        # a chain can't be longer than the FAT, unless it loops
+        hops = len(clustermap)
         # We are not at the end of the chain
-        while nvalue != EntryType.FATX_CLUSTER_END:
+        while value < bad:
             # get the next pointer
-            pointer = self.clustermap[pointer]
-            l.append(pointer)
-            # lookup the pointer, so we can check if it is the end of the chain
-            nvalue = self.getEntryType(self.clustermap[pointer])
-            if nvalue in [
-                EntryType.FATX_CLUSTER_BAD,
-                EntryType.FATX_CLUSTER_RESERVED,
-                EntryType.FATX_CLUSTER_AVAILABLE,
-            ]:
-                raise SystemError("One chain element is invalid", nvalue)
-        return l
+            pointer = value
+            value = clustermap[pointer]
+            if value <= 0x0001 or value == bad:
+                raise SystemError(
+                    "One chain element is invalid", self.getEntryType(value)
+                )
+            hops -= 1
+            if hops == 0:
+                raise SystemError("Cluster chain loops", pointer)
+            if pointer == start + length:
+                length += 1
+            else:
+                extents.append((start, length))
+                start, length = pointer, 1
+        extents.append((start, length))
+        return extents
+
+    # coalesces a list of cluster IDs into (start cluster, run length) pairs,
+    # one pair for every run of consecutive clusters
+    @staticmethod
+    def chainExtents(chain: List[int]):
+        extents = []
+        start = length = 0
+        for cluster in chain:
+            if length and cluster == start + length:
+                length += 1
+                continue
+            if length:
+                extents.append((start, length))
+            start, length = cluster, 1
+        if length:
+            extents.append((start, length))
+        return extents
 
     # frees a given chain, setting all cluster free
     def freeClusterChain(self, chain: List[int]):
         for cluster in chain:
             self.setEntryType(cluster, EntryType.FATX_CLUSTER_AVAILABLE)
 
-    # collects a list of IDs/No. of clusters that are free
+    # collects a list of IDs/No. of clusters that are free,
+    # preferring a single contiguous run. The clusters are taken out of
+    # the free space index, link them with linkClusterChain afterwards
     def getFreeClusterChain(self, nclusters):
-        # l shall store the list of free clusters
-        l = []
-        pos = 1
-        for i in range(nclusters):
-            # Dirty, FIXME!                MagicValue :(
-            l.append(self.clustermap.index(0x0000, pos))
-            pos = l[-1] + 1
-        return l
+        return self.freeSpace().allocate(nclusters)
+
+    # returns the index of free clusters, building it on first use
+    def freeSpace(self):
+        if self._free is None:
+            self._free = FreeSpace(self.clustermap, self.clusters)
+        return self._free
+
+    # appends the clusters in extension to the end of chain
+    def extendClusterChain(self, chain: List[int], extension: List[int]):
+        self.linkClusterChain(extension)
+        # the old end of the chain now points to the extension
+        self.clustermap[chain[-1]] = extension[0]
+        self._chains.forget(chain[-1])
+        self._dirty.add(chain[-1] * self.size // self.PAGE_SIZE)
 
     # links a number of clusters together and terminates the list
     def linkClusterChain(self, cc):
-        clusterchain = cc.copy()
-        index = clusterchain.pop(0)
-        while len(clusterchain) > 0:
-            pointer = clusterchain.pop(0)
+        for index, pointer in zip(cc, cc[1:]):
             self.setEntryType(index, pointer)
-            index = pointer
-        self.setEntryType(index, EntryType.FATX_CLUSTER_END)
+        self.setEntryType(cc[-1], EntryType.FATX_CLUSTER_END)
 
     @classmethod
-    def new(cls, size):
-        self = cls(size * b"\x00")
+    def new(cls, size, clusters: int = None):
+        # an empty table is built directly, without decoding size zero bytes
+        self = cls.__new__(cls)
+        self.size = 2 if size < (0xFFF5 * 2) else 4
+        self.clustermap = array(self._typecode(self.size), [0]) * (size // self.size)
+        self._setup(clusters)
         if self.size == 2:
             self.clustermap[0] = 0xFFF8
             self.clustermap[1] = 0xFFFF
         else:
             self.clustermap[0] = 0xFFFFFFF8
             self.clustermap[1] = 0xFFFFFFFF
+        # all other pages are zero and need not be written to a fresh image
+        self._dirty.add(0)
         return self
 
     def pack(self):
-        data = b""
-        if self.size == 2:
-            datatype = "<H"
-        else:
-            datatype = "<I"
-        for i in self.clustermap:
-            data += struct.pack(datatype, i)
-        if len(data) % 4096:
-            data += (4096 - len(data) % 4096) * b"\x00"
+        data = self._pack_entries(0, len(self.clustermap))
+        if len(data) % self.PAGE_SIZE:
+            data += (self.PAGE_SIZE - len(data) % self.PAGE_SIZE) * b"\x00"
+        self._dirty.clear()
         return data
 
+    # returns (offset, bytes) for every run of modified pages since the last
+    # pack, offsets are relative to the start of the FAT
+    def packDirty(self):
+        per_page = self.PAGE_SIZE // self.size
+        runs = []
+        for page in sorted(self._dirty):
+            if runs and runs[-1][1] == page:
+                runs[-1][1] = page + 1
+            else:
+                runs.append([page, page + 1])
+        self._dirty.clear()
+        return [
+            (first * self.PAGE_SIZE, self._pack_entries(first * per_page, last * per_page))
+            for first, last in runs
+        ]
+
+    def _pack_entries(self, first, last):
+        entries = self.clustermap[first:last]
+        if sys.byteorder != "little":
+            entries.byteswap()
+        return entries.tobytes()
+
     def __str__(self):
         return "FAT: {0} entrys of {1} bytes each".format(
             self.numberClusters(), self.size
         )
 
 
+class ChainCache:
+    """
+    Memoized extents of cluster chains, by start cluster, least recently
+    used first. All runs of all cached chains are also kept sorted by their
+    start, so the chain holding a given cluster is found with a binary
+    search when that cluster changes. Files are read by many threads at
+    once, so every method holds a lock.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # chain start -> extents
+        self._chains = OrderedDict()
+        # sorted starts of all cached runs
+        self._starts = []
+        # run start -> (run length, chain start)
+        self._runs = {}
+
+    def get(self, pointer):
+        with self._lock:
+            extents = self._chains.get(pointer)
+            if extents is not None:
+                self._chains.move_to_end(pointer)
+            return extents
+
+    def put(self, pointer, extents):
+        with self._lock:
+            # Chains sharing clusters are cross-linked, the FAT is broken.
+            # Don't cache those, a cluster may only ever belong to one chain.
+            for start, length in extents:
+                if self._owner(start) is not None:
+                    return
+                i = bisect.bisect_right(self._starts, start)
+                if i < len(self._starts) and self._starts[i] < start + length:
+                    return
+            self._chains[pointer] = extents
+            for start, length in extents:
+                bisect.insort(self._starts, start)
+                self._runs[start] = (length, pointer)
+            if len(self._chains) > self.capacity:
+                self._drop(next(iter(self._chains)))
+
+    # drops the chain holding cluster, if there is one
+    def forget(self, cluster):
+        if self._chains:
+            with self._lock:
+                pointer = self._owner(cluster)
+                if pointer is not None:
+                    self._drop(pointer)
+
+    def clear(self):
+        with self._lock:
+            self._chains.clear()
+            self._starts.clear()
+            self._runs.clear()
+
+    def _owner(self, cluster):
+        i = bisect.bisect_right(self._starts, cluster) - 1
+        if i >= 0:
+            start = self._starts[i]
+            length, pointer = self._runs[start]
+            if cluster < start + length:
+                return pointer
+        return None
+
+    def _drop(self, pointer):
+        for start, length in self._chains.pop(pointer):
+            del self._starts[bisect.bisect_left(self._starts, start)]
+            del self._runs[start]
+
+    def __len__(self):
+        return len(self._chains)
+
+
+# maps a byte OR'ed from all bytes of a FAT entry to 1 if the entry is free
+_FREE = b"\x01" + b"\x00" * 255
+
+
+class FreeSpace:
+    """
+    Index of the free clusters of a FAT, stored as runs of consecutive free
+    clusters. A bitmap tells in O(1) whether a cluster is in the index, the
+    runs are found by their start and end, so freed clusters are merged
+    with their neighbours in O(1). For allocation the runs are kept in
+    buckets by length, each a heap of starts, stale entries are skipped
+    when they come up. The smallest run that fits a request is found by a
+    binary search over the distinct lengths. n free clusters can't form
+    more than sqrt(2n) distinct lengths, so that list stays short even for
+    a nearly full FATX32 table with millions of single free clusters.
+    """
+
+    def __init__(self, clustermap, end: int):
+        # clusters from end on are never handed out
+        self._end = end
+        # 1 for every cluster in the index, see below
+        self._map = None
+        # start -> length and end(exclusive) -> start of every run
+        self._runs = {}
+        self._ends = {}
+        # length -> heap of run starts, may hold starts of runs long gone
+        self._buckets = {}
+        # length -> number of runs of that length
+        self._counts = {}
+        # sorted distinct lengths of all runs
+        self._lengths = []
+        # number of free clusters
+        self.free = 0
+
+        # A free entry consists only of zero bytes. All bytes of an entry
+        # are OR'ed together through big integers, then mapped to 1 for free
+        # and 0 for used, so the bitmap is built without a loop per entry.
+        size = clustermap.itemsize
+        used = 0
+        with memoryview(clustermap).cast("B") as raw:
+            for i in range(size):
+                used |= int.from_bytes(raw[i : end * size : size], "little")
+        self._map = bytearray(used.to_bytes(end, "little").translate(_FREE))
+        for match in re.finditer(b"\x01+", self._map):
+            start, stop = match.span()
+            self._runs[start] = stop - start
+            self._ends[stop] = start
+            self._buckets.setdefault(stop - start, []).append(start)
+            self.free += stop - start
+        # the starts were found in ascending order, so every bucket is a heap
+        self._counts = {length: len(b) for length, b in self._buckets.items()}
+        self._lengths = sorted(self._buckets)
+
+    # takes nclusters free clusters out of the index and returns them
+    def allocate(self, nclusters):
+        if nclusters > self.free:
+            raise ValueError(
+                "Not enough free clusters, {0} needed but only {1} left".format(
+                    nclusters, self.free
+                )
+            )
+        if nclusters == 0:
+            return []
+        # the smallest run that holds all clusters
+        i = bisect.bisect_left(self._lengths, nclusters)
+        if i < len(self._lengths):
+            return self._take(self._first(self._lengths[i]), nclusters)
+
+        # no run is long enough, use the longest ones to keep the pieces few
+        chain = []
+        while len(chain) < nclusters:
+            length = self._lengths[-1]
+            start = self._first(length)
+            chain += self._take(start, min(length, nclusters - len(chain)))
+        chain.sort()
+        return chain
+
+    # puts a single cluster back into the index
+    def release(self, cluster):
+        if cluster >= self._end or self._map[cluster]:
+            return
+        self._map[cluster] = 1
+        self.free += 1
+        start, length = cluster, 1
+        if cluster + 1 in self._runs:
+            length += self._unlink(cluster + 1)
+        if cluster in self._ends:
+            start = self._ends[cluster]
+            length += self._unlink(start)
+        self._link(start, length)
+
+    # takes a single cluster out of the index, if it is in there
+    def discard(self, cluster):
+        if cluster >= self._end or not self._map[cluster]:
+            return
+        # the run starts right after the closest cluster not in the index
+        start = self._map.rfind(0, 0, cluster) + 1
+        length = self._unlink(start)
+        self._map[cluster] = 0
+        self.free -= 1
+        if cluster > start:
+            self._link(start, cluster - start)
+        if cluster + 1 < start + length:
+            self._link(cluster + 1, start + length - cluster - 1)
+
+    def runs(self):
+        return sorted(self._runs.items())
+
+    # takes the first nclusters of the run at start
+    def _take(self, start, nclusters):
+        length = self._unlink(start)
+        if length > nclusters:
+            self._link(start + nclusters, length - nclusters)
+        self._map[start : start + nclusters] = bytes(nclusters)
+        self.free -= nclusters
+        return list(range(start, start + nclusters))
+
+    # returns the lowest start of the runs of length
+    def _first(self, length):
+        bucket = self._buckets[length]
+        while self._runs.get(bucket[0]) != length:
+            heapq.heappop(bucket)
+        return bucket[0]
+
+    # adds a run to the lookups and buckets, the bitmap is up to the caller
+    def _link(self, start, length):
+        self._runs[start] = length
+        self._ends[start + length] = start
+        count = self._counts.get(length, 0)
+        if count == 0:
+            bisect.insort(self._lengths, length)
+            self._buckets[length] = [start]
+        else:
+            bucket = self._buckets[length]
+            heapq.heappush(bucket, start)
+            # drop the stale starts once they outnumber the live ones
+            if len(bucket) > 2 * count + 16:
+                live = {s for s in bucket if self._runs.get(s) == length}
+                bucket[:] = sorted(live)
+        self._counts[length] = count + 1
+
+    def _unlink(self, start):
+        length = self._runs.pop(start)
+        del self._ends[start + length]
+        count = self._counts[length] - 1
+        if count == 0:
+            del self._counts[length]
+            del self._buckets[length]
+            del self._lengths[bisect.bisect_left(self._lengths, length)]
+        else:
+            self._counts[length] = count
+        return length
+
+
+# every byte that is not printable ascii, removed when decoding filenames
+_UNPRINTABLE = bytes(i for i in range(256) if not 0x1F < i < 0x7F)
+
+
 class DirectoryEntry:
     """
     DirectoryEntry, byte representation
@@ -255,6 +598,7 @@ class DirectoryEntry:
     """
 
     DIRECTORY_SIZE = 64
+    _STRUCT = struct.Struct("<BB42sII12x")
 
     """
     Attributes, byte values/mask
@@ -275,32 +619,60 @@ class DirectoryEntry:
     ATR_VOLUMELABEL = 0x08
     ATR_DIRECTORY = 0x10
     ATR_ARCHIVE = 0x20
+    ATR_MASK = 0x3F
 
-    # ToDo: Add pack method
     class Attributes:
-        def __init__(self):
-            self.READONLY = False
-            self.HIDDEN = False
-            self.SYSTEM = False
-            self.VOLUMELABEL = False
-            self.DIRECTORY = False
-            self.ARCHIVE = False
-            self.DELETED = False
+        __slots__ = (
+            "READONLY",
+            "HIDDEN",
+            "SYSTEM",
+            "VOLUMELABEL",
+            "DIRECTORY",
+            "ARCHIVE",
+            "DELETED",
+        )
+
+        def __init__(self, attributes=0, deleted=False):
+            self.READONLY = bool(attributes & DirectoryEntry.ATR_READONLY)
+            self.HIDDEN = bool(attributes & DirectoryEntry.ATR_HIDDEN)
+            self.SYSTEM = bool(attributes & DirectoryEntry.ATR_SYSTEM)
+            self.VOLUMELABEL = bool(attributes & DirectoryEntry.ATR_VOLUMELABEL)
+            self.DIRECTORY = bool(attributes & DirectoryEntry.ATR_DIRECTORY)
+            self.ARCHIVE = bool(attributes & DirectoryEntry.ATR_ARCHIVE)
+            self.DELETED = deleted
+
+        def pack(self):
+            attributes = 0
+            if self.READONLY:
+                attributes |= DirectoryEntry.ATR_READONLY
+            if self.HIDDEN:
+                attributes |= DirectoryEntry.ATR_HIDDEN
+            if self.SYSTEM:
+                attributes |= DirectoryEntry.ATR_SYSTEM
+            if self.VOLUMELABEL:
+                attributes |= DirectoryEntry.ATR_VOLUMELABEL
+            if self.DIRECTORY:
+                attributes |= DirectoryEntry.ATR_DIRECTORY
+            if self.ARCHIVE:
+                attributes |= DirectoryEntry.ATR_ARCHIVE
+            return attributes
+
+    # Walking a big image creates one of these per entry, so they have no
+    # __dict__ and filename/atr are only decoded when somebody asks for them
+    __slots__ = (
+        "namesize",
+        "attributes",
+        "name",
+        "cluster",
+        "size",
+        "origin",
+        "_filename",
+        "_atr",
+    )
 
     def __init__(self, d, origin):
-        # Size of the name
-        self.namesize = 0
-        # The name(all 42 bytes)
-        self.name = 0
-        # the cluster number where the file/directory is saved
-        self.cluster = 1
-        # size of file
-        self.size = 0
-        # The name in ascii (less or equal to 42 bytes)
-        self.filename = ""
         # DirectoryEntryList where this DirectoryEntry was read from
         self.origin = origin
-        self.atr = self.Attributes()
 
         if self.DIRECTORY_SIZE != len(d):
             raise ValueError(
@@ -310,8 +682,19 @@ class DirectoryEntry:
                 + str(self.DIRECTORY_SIZE)
                 + " bytes."
             )
-        raw = struct.unpack("<BB42sII12x", d)
-        self.namesize = raw[0]
+        # Size of the name, the attribute byte, the name(all 42 bytes),
+        # the cluster number where the file/directory is saved and its size
+        (
+            self.namesize,
+            self.attributes,
+            self.name,
+            self.cluster,
+            self.size,
+        ) = self._STRUCT.unpack(d)
+        # The name in ascii (less or equal to 42 bytes), see filename
+        self._filename = None
+        # Decoded attributes, see atr
+        self._atr = None
 
         # This is not a real entry, it may mark the end of the entry list
         if 0xFF == self.namesize or 0x00 == self.namesize:
@@ -319,7 +702,7 @@ class DirectoryEntry:
 
         # This file is deleted(but we will try to recover the name a bit)
         if 0xE5 == self.namesize:
-            self.atr.DELETED = True
+            self._atr = self.Attributes(self.attributes, True)
             self.namesize = 42
 
         # The size of a name cannot exceed the actual byte length of the name field
@@ -332,51 +715,49 @@ class DirectoryEntry:
                 + ")."
             )
 
-        self.attributes = raw[1]
-        self.name = raw[2]
-        self.cluster = raw[3]  # first cluster of the file
-        self.size = raw[4]
-        self.atr.READONLY = bool(self.attributes & self.ATR_READONLY)
-        self.atr.HIDDEN = bool(self.attributes & self.ATR_HIDDEN)
-        self.atr.SYSTEM = bool(self.attributes & self.ATR_SYSTEM)
-        self.atr.VOLUMELABEL = bool(self.attributes & self.ATR_VOLUMELABEL)
-        self.atr.DIRECTORY = bool(self.attributes & self.ATR_DIRECTORY)
-        self.atr.ARCHIVE = bool(self.attributes & self.ATR_ARCHIVE)
-        self.filename = "".join(
-            [chr(i) for i in self.name[: self.namesize] if i > 0x1F and i < 0x7F]
-        )
+    @property
+    def filename(self):
+        if self._filename is None:
+            self._filename = (
+                self.name[: self.namesize].translate(None, _UNPRINTABLE).decode("ascii")
+            )
+        return self._filename
+
+    @property
+    def atr(self):
+        if self._atr is None:
+            self._atr = self.Attributes(self.attributes)
+        return self._atr
+
+    # cheap checks which don't need the attributes to be decoded
+    @property
+    def deleted(self):
+        return self._atr is not None and self._atr.DELETED
+
+    @property
+    def is_directory(self):
+        if self._atr is None:
+            return bool(self.attributes & self.ATR_DIRECTORY)
+        return self._atr.DIRECTORY
 
     def rename(self, name):
         if len(name) > 42:
             raise ValueError("Name is to long (max 42 character)")
-        self.name = bytearray(name, "ascii") + ((42 - len(name)) * b"\xFF")
-        self.filename = name
+        self.name = bytes(name, "ascii") + ((42 - len(name)) * b"\xFF")
+        self._filename = name
         self.namesize = len(name)
 
     def pack(self):
-        def set_bit(boolvalue, bit):
-            if boolvalue:
-                return bit
-            return 0
-
-        self.attributes = 0
-        self.attributes |= set_bit(self.atr.READONLY, self.ATR_READONLY)
-        self.attributes |= set_bit(self.atr.HIDDEN, self.ATR_HIDDEN)
-        self.attributes |= set_bit(self.atr.SYSTEM, self.ATR_SYSTEM)
-        self.attributes |= set_bit(self.atr.VOLUMELABEL, self.ATR_VOLUMELABEL)
-        self.attributes |= set_bit(self.atr.DIRECTORY, self.ATR_DIRECTORY)
-        self.attributes |= set_bit(self.atr.ARCHIVE, self.ATR_ARCHIVE)
-        if self.atr.DELETED:
-            self.namesize = 0xE5
-        raw = struct.pack(
-            "<BB42sII12x",
-            self.namesize,
-            self.attributes,
-            self.name,
-            self.cluster,
-            self.size,
+        namesize = self.namesize
+        if self._atr is None:
+            attributes = self.attributes & self.ATR_MASK
+        else:
+            attributes = self._atr.pack()
+            if self._atr.DELETED:
+                namesize = 0xE5
+        return self._STRUCT.pack(
+            namesize, attributes, self.name, self.cluster, self.size
         )
-        return raw
 
     # ToDo: switch into to functions for either file or directory
     @classmethod
@@ -386,10 +767,11 @@ class DirectoryEntry:
             self.rename(name)
         except ValueError as e:
             raise e
+        self.attributes = 0
         self.cluster = 0
         self.origin = origin
         self.size = 0
-        self.atr = self.Attributes()
+        self._atr = self.Attributes()
         return self
 
     def __str__(self):
@@ -397,15 +779,24 @@ class DirectoryEntry:
 
 
 class DirectoryEntryList:
-    # Cluster is the raw binary block containing one ore more DirectoryEntrys
-    # ToDo: use memoryview and aim for zero-copy
+    # Cluster is the raw binary block containing one ore more DirectoryEntrys,
+    # for directories spanning several clusters all of them concatenated.
     def __init__(self, data, clusterID: int):
+        # first cluster of the directory
         self.cluster = clusterID
         self._l = []
+        # living entries by filename, built on the first lookup so listing
+        # a directory does not decode the names of all of its entries
+        self._names = None
+        # index of the first entry changed since the list was last written,
+        # None if unknown, which means everything has to be written
+        self.first_changed = None
 
         if len(data) % 64 != 0:
             raise ValueError("Invalid datasize")
 
+        # entries are unpacked straight from the buffer, without copying it
+        data = memoryview(data)
         for offset in range(0, len(data), DirectoryEntry.DIRECTORY_SIZE):
             if data[offset] == 0xFF:
                 data = data[:offset]
@@ -413,9 +804,8 @@ class DirectoryEntryList:
             if data[offset] == 0x00:
                 data = data[:offset]
                 break
-        else:
-            # in case break wasn't tiggerd
-            raise SystemError("Missing termination of directory entry list")
+        # without a terminating entry the list fills its whole chain,
+        # so it ends with the data
 
         for offset in range(0, len(data), 64):
             try:
@@ -433,20 +823,55 @@ class DirectoryEntryList:
     def list(self):
         return self._l
 
-    def append(self, directoryentry):
-        if len(self._l) > 254:
-            raise ValueError("Not more then 255 entries allowed in a single directory")
-        for i in self._l:
-            if i.filename == directoryentry.filename:
-                break
-        else:
-            self._l.append(directoryentry)
-            return
-        raise ValueError(directoryentry.filename + " already exists")
+    def _index(self):
+        if self._names is None:
+            self._names = {}
+            for de in self._l:
+                if not de.deleted:
+                    self._names.setdefault(de.filename, de)
+        return self._names
 
-    def pack(self):
-        data = b""
-        for i in self._l:
-            data += i.pack()
+    def get(self, name: str):
+        return self._index().get(name)
+
+    def append(self, directoryentry):
+        names = self._index()
+        if directoryentry.filename in names:
+            raise ValueError(directoryentry.filename + " already exists")
+        self._l.append(directoryentry)
+        names[directoryentry.filename] = directoryentry
+        self._changed(len(self._l) - 1)
+
+    def rename(self, directoryentry, name: str):
+        names = self._index()
+        other = names.get(name)
+        if other is not None and other is not directoryentry:
+            raise ValueError(name + " already exists")
+        old_name = directoryentry.filename
+        directoryentry.rename(name)
+        if names.get(old_name) is directoryentry:
+            del names[old_name]
+        if not directoryentry.deleted:
+            names[name] = directoryentry
+        self.touch(directoryentry)
+
+    def delete(self, directoryentry):
+        directoryentry.atr.DELETED = True
+        names = self._names
+        if names is not None and names.get(directoryentry.filename) is directoryentry:
+            del names[directoryentry.filename]
+        self.touch(directoryentry)
+
+    # marks an entry as changed, so it gets written
+    def touch(self, directoryentry):
+        self._changed(self._l.index(directoryentry))
+
+    def _changed(self, index: int):
+        if self.first_changed is None or index < self.first_changed:
+            self.first_changed = index
+
+    # packs the entries starting at index first, plus the terminating entry
+    def pack(self, first: int = 0):
+        data = b"".join([i.pack() for i in self._l[first:]])
         data += b"\xFF" * DirectoryEntry.DIRECTORY_SIZE
         return data
@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+
+"""
+A small LRU cache for the clusters read by FATX.Filesystem.
+It is bounded by the number of bytes it holds, not by the number of
+clusters, and counts its hits and misses so callers can tell if it helps.
+It may be used by many threads at once.
+"""
+
+
+class ClusterCache:
+    def __init__(self, capacity: int):
+        # upper limit of cached bytes
+        self.capacity = capacity
+        # currently cached bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # cluster ID -> data, least recently used first
+        self._clusters = OrderedDict()
+
+    def get(self, ID: int):
+        with self._lock:
+            data = self._clusters.get(ID)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clusters.move_to_end(ID)
+            return data
+
+    def put(self, ID: int, data: bytes):
+        if len(data) > self.capacity:
+            return
+        with self._lock:
+            self._invalidate(ID)
+            self._clusters[ID] = data
+            self.size += len(data)
+            while self.size > self.capacity:
+                _, old = self._clusters.popitem(last=False)
+                self.size -= len(old)
+
+    def invalidate(self, ID: int):
+        with self._lock:
+            self._invalidate(ID)
+
+    def _invalidate(self, ID: int):
+        data = self._clusters.pop(ID, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._clusters.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._clusters)
+
+    def __str__(self):
+        return "Cache: {0} clusters, {1}/{2} bytes, {3} hits, {4} misses".format(
+            len(self), self.size, self.capacity, self.hits, self.misses
+        )
@@ -0,0 +1,75 @@
+import os
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from .interface import DirectoryObject
+
+"""
+Extracts a directory tree out of an image into a host directory.
+The tree is walked in the calling thread, which also creates the host
+directories, while the file contents are copied by a pool of threads.
+Every worker copies with FileObject.export_to to an absolute path, so
+nothing depends on the current working directory.
+Names are taken from the image, which may be damaged or crafted, so names
+that would leave dest are refused.
+"""
+
+
+def extract(directory: DirectoryObject, dest: str, jobs: int = None, failed=None):
+    """
+    Extracts all files and folders below directory into dest,
+    using jobs threads (default: number of CPUs). Returns the number of
+    files extracted. A file that can't be extracted doesn't stop the others,
+    (path, error) is appended to the list failed if given, else printed.
+    """
+    dest = os.path.abspath(dest)
+    errors = []
+    extracted = 0
+    with ThreadPoolExecutor(jobs or os.cpu_count() or 1) as pool:
+        futures = [
+            (obj, path, pool.submit(obj.export_to, path))
+            for obj, path in _walk(directory, dest, errors)
+        ]
+        for obj, path, future in futures:
+            try:
+                future.result()
+                extracted += 1
+            except (OSError, ValueError, SystemError) as e:
+                errors.append((obj.path(), _describe(e)))
+                # don't leave a truncated copy behind
+                with contextlib.suppress(OSError):
+                    os.unlink(path)
+    errors.sort()
+    if failed is None:
+        for path, error in errors:
+            print("{0}: {1}".format(path, error))
+    else:
+        failed += errors
+    return extracted
+
+
+def _describe(e: Exception):
+    return "{0}: {1}".format(type(e).__name__, e)
+
+
+# a name that stays inside the directory it is joined to
+def _safe(name: str):
+    return name not in ("", ".", "..") and "/" not in name and "\0" not in name
+
+
+# yields (FileObject, host path) for every file, creating directories on the way
+def _walk(directory: DirectoryObject, dest: str, errors):
+    for item in directory.ls():
+        name = str(item)
+        if not _safe(name):
+            errors.append((item.path(), "unsafe name {0!r}".format(name)))
+            continue
+        path = os.path.join(dest, name)
+        if isinstance(item, DirectoryObject):
+            try:
+                os.mkdir(path)
+            except OSError as e:
+                errors.append((item.path(), _describe(e)))
+                continue
+            yield from _walk(item, path, errors)
+        else:
+            yield item, path
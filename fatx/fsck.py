@@ -0,0 +1,389 @@
+import math
+from itertools import islice
+from .blocks import EntryType, DirectoryEntryList
+
+"""
+Checks the consistency of a FATX partition.
+Every chain reachable from the root is walked exactly once, marking its
+clusters in a bytearray, so a cluster claimed twice is found in O(1)
+instead of comparing chains with each other. One linear pass over the FAT
+afterwards finds every used cluster nobody claimed. Nothing is read or
+walked twice, so even full-size FATX32 partitions are checked in seconds.
+Directory lists are parsed from the clusters found by the check itself,
+a broken chain never makes the walk fail.
+"""
+
+
+class Report:
+    """
+    The result of check(). All lists are empty for a healthy filesystem.
+    Paths are absolute paths inside the filesystem.
+    """
+
+    def __init__(self, cluster_size: int):
+        self.cluster_size = cluster_size
+        # (path, cluster) the chain of path runs into a cluster of another chain
+        self.crosslinks = []
+        # (path, cluster) the chain of path loops back to cluster
+        self.loops = []
+        # (path, cluster) cluster of path points to a free, bad or invalid cluster
+        self.broken = []
+        # (path, size, clusters) the chain does not fit the size of a file
+        self.size_mismatches = []
+        # (path, error) directory lists which can't be parsed
+        self.bad_directories = []
+        # (first cluster, length) used chains no directory entry points to
+        self.orphans = []
+        # (cluster, length) used clusters forming a loop without any entry
+        self.orphan_loops = []
+        # (path, first cluster, length) chains only deleted entries point to,
+        # their files can still be recovered. Not a problem, see purge
+        self.deleted = []
+        self.files = 0
+        self.directories = 0
+        self.used = 0
+        self.free = 0
+        self.bad = 0
+        # clusters that are used but can't be reached
+        self.lost = 0
+        # number of entries, orphaned chains and loops fixed by repair
+        self.repaired = 0
+        # number of deleted chains freed by purge
+        self.purged = 0
+
+    @property
+    def clean(self):
+        return not (
+            self.crosslinks
+            or self.loops
+            or self.broken
+            or self.size_mismatches
+            or self.bad_directories
+            or self.orphans
+            or self.orphan_loops
+        )
+
+    def as_dict(self):
+        return {
+            "clean": self.clean,
+            "files": self.files,
+            "directories": self.directories,
+            "used": self.used,
+            "free": self.free,
+            "bad": self.bad,
+            "lost": self.lost,
+            "lost_bytes": self.lost * self.cluster_size,
+            "crosslinks": self.crosslinks,
+            "loops": self.loops,
+            "broken": self.broken,
+            "size_mismatches": self.size_mismatches,
+            "bad_directories": self.bad_directories,
+            "orphans": self.orphans,
+            "orphan_loops": self.orphan_loops,
+            "deleted": self.deleted,
+            "repaired": self.repaired,
+            "purged": self.purged,
+        }
+
+    def __str__(self):
+        lines = []
+        for path, cluster in self.crosslinks:
+            lines.append("{0}: cross-linked at cluster {1}".format(path, cluster))
+        for path, cluster in self.loops:
+            lines.append("{0}: chain loops back to cluster {1}".format(path, cluster))
+        for path, cluster in self.broken:
+            lines.append("{0}: chain is broken at cluster {1}".format(path, cluster))
+        for path, size, clusters in self.size_mismatches:
+            lines.append(
+                "{0}: {1} bytes stored in {2} clusters".format(path, size, clusters)
+            )
+        for path, error in self.bad_directories:
+            lines.append("{0}: unreadable directory ({1})".format(path, error))
+        for cluster, length in self.orphans:
+            lines.append("orphaned chain of {1} clusters at {0}".format(cluster, length))
+        for cluster, length in self.orphan_loops:
+            lines.append("orphaned loop of {1} clusters at {0}".format(cluster, length))
+        for path, cluster, length in self.deleted:
+            lines.append(
+                "{0}: deleted, {2} clusters at {1} still allocated".format(
+                    path, cluster, length
+                )
+            )
+        lines.append(
+            "{0} files, {1} directories, {2} used, {3} free, {4} bad clusters".format(
+                self.files, self.directories, self.used, self.free, self.bad
+            )
+        )
+        lines.append(
+            "{0} clusters ({1} bytes) lost".format(
+                self.lost, self.lost * self.cluster_size
+            )
+        )
+        if self.repaired:
+            lines.append("{0} problems repaired".format(self.repaired))
+        if self.purged:
+            lines.append("{0} deleted chains freed".format(self.purged))
+        return "\n".join(lines)
+
+
+def check(fs, repair: bool = False, purge: bool = False):
+    """
+    Checks the filesystem fs and returns a Report. With repair, broken
+    chains are terminated, chains are cut to the size of their file (or
+    the file size to its chain), cross-linked files lose the shared clusters
+    and lost clusters are freed. Unreadable directories are only reported.
+    Chains still held by deleted entries are left alone, with purge they
+    are freed as well and the deleted files can't be recovered anymore.
+    Objects of fs read before the repair are outdated, open it again.
+    """
+    return _Checker(fs).run(repair, purge)
+
+
+class _Checker:
+    def __init__(self, fs):
+        self.fs = fs
+        self.fat = fs.fat
+        self.clustermap = fs.fat.clustermap
+        self.end = fs.fat.clusters
+        self.bad = fs.fat._bad
+        self.cluster_size = fs.sb.cluster_size
+        # 1 for every cluster claimed by a reachable chain
+        self.seen = bytearray(self.end)
+        self.report = Report(self.cluster_size)
+        # (DirectoryEntry, claimed chain) for every entry repair has to fix
+        self.fixes = []
+        # used clusters not claimed by any entry
+        self.lost = []
+        # (DirectoryEntry, path) of every deleted entry found by the walk
+        self.deleted_entries = []
+        # clusters claimed by deleted entries only
+        self.deleted_clusters = []
+
+    def run(self, repair: bool, purge: bool = False):
+        root = self._claim(1, "/")
+        if self._problems():
+            # the root has no entry, repair only terminates its chain
+            if not root:
+                # like Filesystem, fall back to the first cluster
+                self.seen[1] = 1
+                root = [1]
+            self.fixes.append((None, root))
+        self._directory(root, "/")
+        self._deleted()
+        self._scan()
+        if repair:
+            self._repair()
+        if purge:
+            self._purge()
+        return self.report
+
+    # walks the chain starting at cluster, marking it as seen. Returns the
+    # clusters up to the first problem, which is recorded for path
+    def _claim(self, cluster: int, path: str):
+        clustermap = self.clustermap
+        seen = self.seen
+        bad = self.bad
+        end = self.end
+        chain = []
+        if not 0 < cluster < end or clustermap[cluster] <= 0x0001:
+            self.report.broken.append((path, cluster))
+            return chain
+        while True:
+            if seen[cluster]:
+                if cluster in set(chain):
+                    self.report.loops.append((path, cluster))
+                else:
+                    self.report.crosslinks.append((path, cluster))
+                return chain
+            seen[cluster] = 1
+            chain.append(cluster)
+            value = clustermap[cluster]
+            if value > bad:
+                return chain
+            if value == bad or value >= end or clustermap[value] <= 0x0001:
+                self.report.broken.append((path, cluster))
+                return chain
+            cluster = value
+
+    # checks all entries of a directory, given its claimed chain
+    def _directory(self, chain, path: str):
+        self.report.directories += 1
+        try:
+            dl = DirectoryEntryList(self._read(chain), chain[0])
+        except (ValueError, SystemError) as e:
+            self.report.bad_directories.append((path, str(e)))
+            return
+        problems = self._problems()
+        for de in dl.list():
+            child = path.rstrip("/") + "/" + de.filename
+            if de.deleted:
+                self.deleted_entries.append((de, child))
+                continue
+            if not de.is_directory and de.size == 0 and de.cluster == 0:
+                # empty files have no clusters at all
+                self.report.files += 1
+                continue
+            before = problems
+            claimed = self._claim(de.cluster, child)
+            problems = self._problems()
+            if de.is_directory:
+                if problems != before:
+                    self.fixes.append((de, claimed))
+                if claimed:
+                    self._directory(claimed, child)
+                continue
+            self.report.files += 1
+            if problems == before:
+                if self._needed(de) == len(claimed):
+                    continue
+                self.report.size_mismatches.append((child, de.size, len(claimed)))
+            self.fixes.append((de, claimed))
+
+    # number of clusters a file of this size has to have
+    def _needed(self, de):
+        return max(1, math.ceil(de.size / self.cluster_size))
+
+    def _problems(self):
+        return (
+            len(self.report.broken)
+            + len(self.report.loops)
+            + len(self.report.crosslinks)
+        )
+
+    def _read(self, chain):
+        return b"".join(
+            [
+                bytes(
+                    self.fs._read(
+                        self.fs._cluster_id_offset(start), length * self.cluster_size
+                    )
+                )
+                for start, length in self.fat.chainExtents(chain)
+            ]
+        )
+
+    # Claims the chains still held by deleted entries, after the walk, so
+    # they only get the clusters no living entry claimed. The content of
+    # deleted directories is deleted as well
+    def _deleted(self):
+        for de, path in self.deleted_entries:
+            chain = self._claim_deleted(de.cluster)
+            if not chain:
+                continue
+            self.report.deleted.append((path, chain[0], len(chain)))
+            self.deleted_clusters += chain
+            if not de.is_directory:
+                continue
+            try:
+                dl = DirectoryEntryList(self._read(chain), chain[0])
+            except (ValueError, SystemError):
+                continue
+            for child in dl.list():
+                self.deleted_entries.append(
+                    (child, path.rstrip("/") + "/" + child.filename)
+                )
+
+    # walks a chain of a deleted entry as far as it is intact and unclaimed
+    def _claim_deleted(self, cluster: int):
+        clustermap = self.clustermap
+        seen = self.seen
+        bad = self.bad
+        chain = []
+        while 0 < cluster < self.end and not seen[cluster]:
+            value = clustermap[cluster]
+            if value <= 0x0001 or value == bad:
+                break
+            seen[cluster] = 1
+            chain.append(cluster)
+            if value > bad:
+                break
+            cluster = value
+        return chain
+
+    # the linear pass over the FAT: counts the clusters and collects
+    # every used one that was not claimed by the walk
+    def _scan(self):
+        report = self.report
+        seen = self.seen
+        bad = self.bad
+        lost = []
+        free = bad_clusters = 0
+        for cluster, value in enumerate(islice(self.clustermap, 1, self.end), 1):
+            if value == 0x0000:
+                free += 1
+            elif value == bad:
+                bad_clusters += 1
+            elif not seen[cluster]:
+                lost.append(cluster)
+        report.free = free
+        report.bad = bad_clusters
+        report.used = self.end - 1 - free - bad_clusters
+        report.lost = len(lost)
+        self.lost = lost
+        self._group(lost)
+
+    # splits the lost clusters into orphaned chains and loops
+    def _group(self, lost):
+        clustermap = self.clustermap
+        end = self.end
+        orphan = bytearray(end)
+        for cluster in lost:
+            orphan[cluster] = 1
+        # lost clusters some other lost cluster points to
+        linked = bytearray(end)
+        for cluster in lost:
+            value = clustermap[cluster]
+            if value < end and orphan[value]:
+                linked[value] = 1
+        heads = [cluster for cluster in lost if not linked[cluster]]
+        for cluster in heads:
+            self.report.orphans.append((cluster, self._follow(cluster, orphan)))
+        # whatever is left only points in circles
+        for cluster in lost:
+            if orphan[cluster]:
+                self.report.orphan_loops.append((cluster, self._follow(cluster, orphan)))
+
+    # counts and unmarks the orphaned clusters reachable from cluster
+    def _follow(self, cluster: int, orphan):
+        length = 0
+        while cluster < self.end and orphan[cluster]:
+            orphan[cluster] = 0
+            length += 1
+            cluster = self.clustermap[cluster]
+        return length
+
+    # The batch writes the FAT first and the directory lists afterwards,
+    # along the already repaired chains
+    def _repair(self):
+        fat = self.fat
+        changed = []
+        with self.fs.batch():
+            for de, chain in self.fixes:
+                if de is None:
+                    # the root directory
+                    pass
+                elif not chain:
+                    # nothing usable is left of this entry
+                    de.origin.delete(de)
+                    changed.append(de)
+                    continue
+                elif not de.is_directory:
+                    needed = self._needed(de)
+                    fat.freeClusterChain(chain[needed:])
+                    chain = chain[:needed]
+                    if de.size > len(chain) * self.cluster_size:
+                        de.size = len(chain) * self.cluster_size
+                        changed.append(de)
+                if fat.clustermap[chain[-1]] <= self.bad:
+                    fat.setEntryType(chain[-1], EntryType.FATX_CLUSTER_END)
+            fat.freeClusterChain(self.lost)
+            for de in changed:
+                self.fs._write_directory_entry(de)
+        self.report.repaired = (
+            len(self.fixes) + len(self.report.orphans) + len(self.report.orphan_loops)
+        )
+
+    def _purge(self):
+        with self.fs.batch():
+            self.fat.freeClusterChain(self.deleted_clusters)
+        self.report.purged = len(self.report.deleted)
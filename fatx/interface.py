@@ -1,3 +1,4 @@
+import os
 from .blocks import DirectoryEntry, DirectoryEntryList
 
 """
@@ -17,24 +18,25 @@ the methodes. :)
 
 
 class FatxObject:
-    _filesystem = None
-
-    @classmethod
-    def registerFilesystem(cls, fs):
-        cls._filesystem = fs
-
     # Note: type hinting with selfreference(for parent) is possible but ugly :(
     def __init__(self, directoryentry: DirectoryEntry, parent):
         self._de = directoryentry
         self._name = self._de.filename
-        self.attributes = self._de.atr
         self._parent = parent
+        # Sadly, sometimes the interfaces need to access the filesystem,
+        # every object belongs to the one of its root
+        self._filesystem = parent._filesystem
+
+    @property
+    def attributes(self):
+        return self._de.atr
 
     def details(self):
         """
         Prints its own attributes
         """
-        return self._de.atr.__dict__
+        atr = self._de.atr
+        return {i: getattr(atr, i) for i in atr.__slots__}
 
     def parent(self):
         """
@@ -43,19 +45,30 @@ class FatxObject:
         """
         return self._parent
 
+    def path(self):
+        """
+        returns the absolute path of this object inside the filesystem
+        """
+        return self._parent.path().rstrip("/") + "/" + self._name
+
     def rename(self, name: str):
         """
         renames this object and safes the change to disk
         """
         try:
+            old_path = self.path()
             self._filesystem.rename_object(self._de, name)
-            self._name = self._de.filename
+            old_name, self._name = self._name, self._de.filename
+            self._parent._rename_child(old_name, self)
+            self._filesystem._forget_path(old_path)
+            self._filesystem._forget_path(self.path())
         except ValueError as e:
             print(e)
 
-    def delete(self):
+    def delete(self, clean: bool = False):
         """
-        Marks this object as deleted and safes change to disk
+        Marks this object as deleted and safes change to disk,
+        with clean its space is freed, the data can't be recovered then
         """
         raise NotImplementedError("Override this in the subclass")
 
@@ -67,11 +80,18 @@ class FatxObject:
 
 
 class FileObject(FatxObject):
-    def delete(self):
+    def delete(self, clean: bool = False):
         """
         deletes this file
         """
-        return self._filesystem.delete_file(self._de)
+        self._filesystem._forget_path(self.path())
+        return self._filesystem.delete_file(self._de, clean)
+
+    def replace(self, data: bytes):
+        """
+        replaces the content of this file with data
+        """
+        self._filesystem.replace_file(self._de, data)
 
     def export(self):
         """
@@ -79,6 +99,32 @@ class FileObject(FatxObject):
         """
         return self._filesystem.read_file(self._de)
 
+    def open(self):
+        """
+        returns a read-only, seekable file object to stream this file
+        """
+        return self._filesystem.open_file(self._de)
+
+    def digest(self, algorithm: str = "sha256"):
+        """
+        returns the hash of this file as hex string, for any hashlib
+        algorithm or the ones of xxhash (e.g. xxh3_64), if installed
+        """
+        return self._filesystem.hash_file(self._de, algorithm)
+
+    def export_to(self, path_or_fd):
+        """
+        writes this file to a host path or to an open file descriptor,
+        the data is copied by the kernel wherever it supports it
+        """
+        if isinstance(path_or_fd, int):
+            return self._filesystem.export_file(self._de, path_or_fd)
+        fd = os.open(path_or_fd, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            self._filesystem.export_file(self._de, fd)
+        finally:
+            os.close(fd)
+
 
 class DirectoryObject(FatxObject):
     """
@@ -90,59 +136,108 @@ class DirectoryObject(FatxObject):
     ):  # directorylist: DirectoryEntryList):
         super().__init__(directoryentry, parent)
 
-        # get a list of all files in the subdir,
-        # note: You'll get a DirectoryEntryList(DEL) in return
-        # This DEL enables you to append files and writing them to disk
-        self._dl = self._filesystem.open_directory(directoryentry)
+        # The list of all files in the subdir is only read on first access,
+        # see _directory(). You'll get a DirectoryEntryList(DEL) there,
+        # this DEL enables you to append files and writing them to disk
+        self._dl = None
+        self._loaded = False
 
-        # Prepare a list of FatxObjects for easy access later on
+        # Prepare a list of FatxObjects for easy access later on,
+        # plus an index of them by name
         self._elements = None
+        self._index = None
 
     def ls(self, deleted=False):
         """
         list all items in this directory
         """
-        if self._elements is None:
-            self._elements = self._create_obj_list()
-        return [i for i in self._elements if (not i.attributes.DELETED or deleted)]
+        return [i for i in self._children() if (not i._de.deleted or deleted)]
 
     def get(self, name: str):
         """
         returns the FatxObject for a given filename
         """
-        if self._elements is None:
-            self._elements = self._create_obj_list()
-
-        for i in self._elements:
-            if i._name == name:
-                return i
-        raise IndexError()
+        self._children()
+        try:
+            return self._index[name]
+        except KeyError:
+            raise IndexError(name)
 
     def import_file(self, filename: str, data: bytes):
         """
         imports a given bytearray to filename into this folder
         """
         try:
-            self._filesystem.import_file(self._dl, filename, data)
-            self._elements = self._create_obj_list()
+            de = self._filesystem.import_file(self._directory(), filename, data)
+            self._add_child(de)
+            self._filesystem._forget_path(self.path().rstrip("/") + "/" + filename)
         except ValueError as e:
             print(e)
 
+    def delete(self, clean: bool = False):
+        """
+        deletes this directory, with clean everything inside it as well
+        """
+        if clean:
+            for i in self.ls():
+                i.delete(clean)
+        self._filesystem._forget_path(self.path())
+        return self._filesystem.delete_file(self._de, clean)
+
     def create_dir(self, dirname: str):
         try:
-            self._filesystem.create_folder(self._dl, dirname)
-            self._elements = self._create_obj_list()
+            de = self._filesystem.create_folder(self._directory(), dirname)
+            self._add_child(de)
+            self._filesystem._forget_path(self.path().rstrip("/") + "/" + dirname)
         except ValueError as e:
             print(e)
 
+    # reads the DirectoryEntryList of this directory on first use
+    def _directory(self):
+        if not self._loaded:
+            self._dl = self._filesystem.open_directory(self._de)
+            self._loaded = True
+        return self._dl
+
+    def _children(self):
+        if self._elements is None:
+            self._elements = self._create_obj_list()
+            self._index = {}
+            for i in self._elements:
+                self._index_child(i)
+        return self._elements
+
+    # keeps an already built list up to date, instead of rebuilding it
+    def _add_child(self, de: DirectoryEntry):
+        if self._elements is not None:
+            obj = self._create_obj(de)
+            self._elements.append(obj)
+            self._index_child(obj)
+
+    def _rename_child(self, old_name: str, obj: FatxObject):
+        if self._index is None:
+            return
+        if self._index.get(old_name) is obj:
+            del self._index[old_name]
+        self._index_child(obj)
+
+    # deleted entries never hide a living one with the same name
+    def _index_child(self, obj: FatxObject):
+        other = self._index.get(obj._name)
+        if other is None or other._de.deleted:
+            self._index[obj._name] = obj
+
+    def _create_obj(self, de: DirectoryEntry):
+        if de.is_directory:
+            return DirectoryObject(de, self)
+        return FileObject(de, self)
+
     def _create_obj_list(self):
         elements = []
-        if self._dl is not None:
-            for i in self._dl.list():
-                if i.atr.DIRECTORY:
-                    elements.append(DirectoryObject(i, self))
-                else:
-                    elements.append(FileObject(i, self))
+        dl = self._directory()
+        if dl is not None:
+            for i in dl.list():
+                elements.append(self._create_obj(i))
         else:
             print("Warning this Folder errored while reading: " + self._name)
         return elements
@@ -155,10 +250,13 @@ class RootObject(DirectoryObject):
      not have its own DirectoryEntry
     """
 
-    def __init__(self, directorylist: DirectoryEntryList):
+    def __init__(self, directorylist: DirectoryEntryList, filesystem):
         self._parent = self
+        self._filesystem = filesystem
         self._dl = directorylist
+        self._loaded = True
         self._elements = None
+        self._index = None
 
     def details(self):
         raise TypeError("This is your root!")
@@ -166,5 +264,11 @@ class RootObject(DirectoryObject):
     def rename(self, name):
         raise TypeError("You can't rename the filesystem root")
 
+    def delete(self, clean=False):
+        raise TypeError("You can't delete the filesystem root")
+
+    def path(self):
+        return "/"
+
     def __str__(self):
         return "Root of the filesystem"
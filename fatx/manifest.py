@@ -0,0 +1,90 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .FATX import new_hasher
+from .interface import DirectoryObject
+
+"""
+Hashes every file below a directory of an image and finds duplicates.
+Like extract, the tree is walked in the calling thread while a pool of
+threads hashes the files. Every file is streamed run by run through the
+hasher with positional reads, hashlib (and xxhash) release the GIL while
+hashing, so the threads keep the disk busy.
+"""
+
+# path inside the image, size in bytes, first cluster and hex digest
+Entry = namedtuple("Entry", ["path", "size", "cluster", "digest"])
+
+
+def build(
+    directory: DirectoryObject, algorithm: str = "sha256", jobs: int = None, failed=None
+):
+    """
+    Returns an Entry for every file below directory, sorted by path,
+    hashed by jobs threads (default: number of CPUs). A file that can't be
+    read doesn't stop the others, (path, error) is appended to the list
+    failed if given, else printed. An unknown algorithm raises ValueError.
+    """
+    new_hasher(algorithm)
+    entries = []
+    errors = []
+    with ThreadPoolExecutor(jobs or os.cpu_count() or 1) as pool:
+        futures = [
+            (obj, pool.submit(obj.digest, algorithm)) for obj in _files(directory)
+        ]
+        for obj, future in futures:
+            try:
+                digest = future.result()
+            except (OSError, ValueError, SystemError) as e:
+                errors.append((obj.path(), "{0}: {1}".format(type(e).__name__, e)))
+                continue
+            entries.append(Entry(obj.path(), obj._de.size, obj._de.cluster, digest))
+    entries.sort()
+    errors.sort()
+    if failed is None:
+        for path, error in errors:
+            print("{0}: {1}".format(path, error))
+    else:
+        failed += errors
+    return entries
+
+
+def duplicates(entries):
+    """
+    Returns the groups of entries with the same content, each sorted by
+    path, the groups wasting the most space first. Empty files are ignored.
+    """
+    groups = {}
+    for entry in entries:
+        if entry.size:
+            groups.setdefault((entry.size, entry.digest), []).append(entry)
+    found = [sorted(group) for group in groups.values() if len(group) > 1]
+    found.sort(key=lambda group: (-group[0].size * (len(group) - 1), group[0].path))
+    return found
+
+
+def write(entries, f):
+    """
+    writes entries to the text file f, one tab separated line per file
+    """
+    for entry in entries:
+        f.write("{0}\t{1}\t{2}\t{3}\n".format(*entry))
+
+
+def read(f):
+    """
+    reads the entries written by write
+    """
+    entries = []
+    for line in f:
+        path, size, cluster, digest = line.rstrip("\n").split("\t")
+        entries.append(Entry(path, int(size), int(cluster), digest))
+    return entries
+
+
+def _files(directory: DirectoryObject):
+    for item in directory.ls():
+        if isinstance(item, DirectoryObject):
+            yield from _files(item)
+        else:
+            yield item
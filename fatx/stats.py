@@ -0,0 +1,114 @@
+import time
+import threading
+import functools
+
+"""
+Counters and timings for the I/O of FATX.Filesystem.
+The counters are always kept, they are a few integer additions next to
+a system call. Timing the operations, and calling a trace hook after each
+of them, has to be turned on with Filesystem.trace(), until then a timed
+operation costs a single attribute check.
+"""
+
+
+class Histogram:
+    """
+    Durations of one operation in power-of-two buckets,
+    bucket i counts the calls taking less than 2**i microseconds.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        bucket = min(int(seconds * 1000000).bit_length(), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            # upper bound in microseconds -> number of calls
+            "buckets": {2 ** i: n for i, n in enumerate(self.counts) if n},
+        }
+
+
+class Stats:
+    COUNTERS = (
+        "reads",
+        "read_bytes",
+        "writes",
+        "write_bytes",
+        "seeks",
+        "copies",
+        "copy_bytes",
+        "fat_flushes",
+        "directory_flushes",
+        "fsyncs",
+        "skipped_writes",
+    )
+
+    def __init__(self):
+        # the image may be read by many threads at once, see extract
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        # operation -> Histogram, only filled while timing is on
+        self.histograms = {}
+        self.timing = False
+        # called with (operation, seconds) after every timed operation
+        self.hook = None
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def record(self, operation: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(operation)
+            if histogram is None:
+                histogram = self.histograms[operation] = Histogram()
+            histogram.add(seconds)
+        if self.hook is not None:
+            self.hook(operation, seconds)
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+            self.histograms = {}
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timings": {k: v.as_dict() for k, v in self.histograms.items()},
+            }
+
+
+# times a method of an object holding its Stats in _stats
+def timed(operation: str):
+    def decorate(func):
+        @functools.wraps(func)
+        def call(self, *args, **kwargs):
+            stats = self._stats
+            if not stats.timing:
+                return func(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                stats.record(operation, time.perf_counter() - start)
+
+        return call
+
+    return decorate
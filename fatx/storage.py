@@ -0,0 +1,134 @@
+import os
+import mmap
+import stat
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not on windows
+    fcntl = None
+
+"""
+Access to the storage an image lives on, be it a plain file or a block
+device. Block devices report a size of 0 through stat, so the size is
+asked from the kernel instead. DirectReader reads with O_DIRECT, which
+keeps bulk reads of whole drives out of the page cache. O_DIRECT needs
+offsets, sizes and buffers aligned to the logical sector size, so reads
+go through aligned bounce buffers.
+"""
+
+# from linux/fs.h
+BLKSSZGET = 0x1268
+BLKGETSIZE64 = 0x80081272
+
+# alignment used when the device does not tell, fine for any common disk
+DEFAULT_ALIGNMENT = 4096
+
+# size of the aligned buffer every reading thread gets
+DIRECT_BUFFER_SIZE = 1024 * 1024
+
+
+def device_size(fd: int):
+    """
+    Returns the size in bytes of an open file or block device
+    """
+    st = os.fstat(fd)
+    if not stat.S_ISBLK(st.st_mode):
+        return st.st_size
+    if fcntl is not None:
+        try:
+            buf = fcntl.ioctl(fd, BLKGETSIZE64, b"\x00" * 8)
+            return struct.unpack("Q", buf)[0]
+        except OSError:
+            pass
+    # seeking to the end works for block devices on most systems
+    return os.lseek(fd, 0, os.SEEK_END)
+
+
+def logical_sector_size(fd: int):
+    """
+    Returns the alignment O_DIRECT needs for an open file or block device
+    """
+    st = os.fstat(fd)
+    if stat.S_ISBLK(st.st_mode) and fcntl is not None:
+        try:
+            buf = fcntl.ioctl(fd, BLKSSZGET, b"\x00" * 4)
+            return max(struct.unpack("i", buf)[0], 512)
+        except OSError:
+            pass
+    return DEFAULT_ALIGNMENT
+
+
+class DirectReader:
+    """
+    Reads from a file or block device with O_DIRECT, bypassing the page
+    cache. Safe to use from many threads, only positional reads are used
+    and every thread gets its own aligned buffer.
+    """
+
+    def __init__(self, path: str):
+        if not hasattr(os, "O_DIRECT"):
+            raise OSError("O_DIRECT is not supported on this system")
+        self.fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+        self.alignment = logical_sector_size(self.fd)
+        self.size = device_size(self.fd)
+        self._buffers = threading.local()
+
+    def readinto(self, offset: int, buffer):
+        """
+        Fills buffer with the bytes at offset, returns the number of bytes
+        read, which is less than len(buffer) only at the end of the device
+        """
+        done = 0
+        aligned_buffer = self._buffer()
+        with memoryview(buffer) as view:
+            while done < len(view):
+                pos = offset + done
+                start = pos - pos % self.alignment
+                skip = pos - start
+                # whole sectors covering the rest, at most one buffer full
+                size = min(skip + len(view) - done, len(aligned_buffer))
+                size += -size % self.alignment
+                with memoryview(aligned_buffer)[:size] as chunk:
+                    n = os.preadv(self.fd, [chunk], start) - skip
+                    if n <= 0:
+                        break
+                    n = min(n, len(view) - done)
+                    view[done : done + n] = chunk[skip : skip + n]
+                done += n
+        return done
+
+    def copy_to(self, offset: int, size: int, fd: int):
+        """
+        Writes size bytes from offset to the file descriptor fd,
+        straight out of the aligned buffer
+        """
+        aligned_buffer = self._buffer()
+        while size > 0:
+            start = offset - offset % self.alignment
+            skip = offset - start
+            length = min(skip + size, len(aligned_buffer))
+            length += -length % self.alignment
+            with memoryview(aligned_buffer)[:length] as chunk:
+                n = min(os.preadv(self.fd, [chunk], start) - skip, size)
+                if n <= 0:
+                    raise SystemError("Unexpected end of device", offset)
+                with chunk[skip : skip + n] as data:
+                    while len(data):
+                        data = data[os.write(fd, data) :]
+            offset += n
+            size -= n
+
+    def read(self, offset: int, size: int):
+        data = bytearray(size)
+        return bytes(data[: self.readinto(offset, data)])
+
+    def close(self):
+        os.close(self.fd)
+
+    def _buffer(self):
+        # anonymous mappings are page aligned, which is good for any sector size
+        if not hasattr(self._buffers, "buffer"):
+            self._buffers.buffer = mmap.mmap(-1, DIRECT_BUFFER_SIZE)
+        return self._buffers.buffer
@@ -0,0 +1,219 @@
+import os
+import json
+import hashlib
+from .blocks import DirectoryEntry
+from .interface import DirectoryObject
+
+"""
+Brings a directory of an existing image up to date with a host directory.
+Both trees are walked together, only files which were added, changed or
+removed on the host are imported, replaced or deleted. Whether a file
+changed is decided by the manifest of the last sync if there is one: an
+unchanged size and modification time on the host mean an unchanged file,
+nothing is read. Otherwise the sizes and, if equal, the SHA-256 of both
+files are compared. Wrap the sync in Filesystem.batch() to write the FAT
+and every directory once.
+"""
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class Manifest:
+    """
+    Size, modification time (on the host) and SHA-256 of every file
+    synced into an image, by path inside the image. Stored as JSON.
+    """
+
+    VERSION = 1
+
+    def __init__(self, files: dict = None):
+        self.files = files if files is not None else {}
+
+    @classmethod
+    def load(cls, path: str):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            raise ValueError("Unsupported manifest version " + str(data.get("version")))
+        return cls(data["files"])
+
+    def save(self, path: str):
+        # replaced in one step, an interrupted save keeps the old manifest
+        with open(path + ".tmp", "w") as f:
+            json.dump({"version": self.VERSION, "files": self.files}, f)
+        os.replace(path + ".tmp", path)
+
+    # True if the host file is the one recorded for path
+    def unchanged(self, path: str, stat):
+        known = self.files.get(path)
+        return (
+            known is not None
+            and known["size"] == stat.st_size
+            and known["mtime_ns"] == stat.st_mtime_ns
+        )
+
+    def record(self, path: str, stat, sha256: str):
+        self.files[path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+        }
+
+    # drops path and everything below it
+    def forget(self, path: str):
+        below = path + "/"
+        for key in [k for k in self.files if k == path or k.startswith(below)]:
+            del self.files[key]
+
+
+class SyncResult:
+    def __init__(self):
+        self.imported = 0
+        self.replaced = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.directories = 0
+        # bytes of file data written to the image
+        self.written = 0
+        # (path, error) files and directories which could not be synced
+        self.failed = []
+
+    def __str__(self):
+        lines = ["{0}: {1}".format(path, error) for path, error in self.failed]
+        lines.append(
+            "{0} imported, {1} replaced, {2} deleted, {3} unchanged files, "
+            "{4} new directories, {5} bytes written, {6} failed".format(
+                self.imported,
+                self.replaced,
+                self.deleted,
+                self.unchanged,
+                self.directories,
+                self.written,
+                len(self.failed),
+            )
+        )
+        return "\n".join(lines)
+
+
+def sync(
+    directory: DirectoryObject,
+    src: str,
+    manifest: Manifest = None,
+    delete: bool = True,
+    clean: bool = True,
+):
+    """
+    Makes directory a copy of the host directory src and returns a
+    SyncResult. With delete, whatever is missing in src is deleted, with
+    clean its space is freed. manifest, if given, is used and updated.
+    Files which can't be synced, e.g. because their name doesn't fit into
+    FATX, are skipped and listed in SyncResult.failed.
+    """
+    result = SyncResult()
+    _sync(directory, os.path.abspath(src), manifest, delete, clean, result)
+    return result
+
+
+def _sync(directory, src, manifest, delete, clean, result):
+    base = directory.path().rstrip("/")
+    image = {str(i): i for i in directory.ls()}
+    with os.scandir(src) as it:
+        host = sorted(it, key=lambda entry: entry.name)
+    for entry in host:
+        path = base + "/" + entry.name
+        obj = image.pop(entry.name, None)
+        if entry.is_dir():
+            if obj is not None and not isinstance(obj, DirectoryObject):
+                _delete(obj, path, manifest, clean, result)
+                obj = None
+            if obj is None:
+                if not _valid(entry.name, path, result):
+                    continue
+                directory.create_dir(entry.name)
+                obj = _created(directory, entry.name)
+                if obj is None:
+                    result.failed.append((path, "could not create directory"))
+                    continue
+                result.directories += 1
+            _sync(obj, entry.path, manifest, delete, clean, result)
+            continue
+
+        if isinstance(obj, DirectoryObject):
+            _delete(obj, path, manifest, clean, result)
+            obj = None
+        stat = entry.stat()
+        if obj is not None:
+            if manifest is not None and manifest.unchanged(path, stat):
+                result.unchanged += 1
+                continue
+            if obj._de.size == stat.st_size:
+                digest = file_hash(entry.path)
+                if digest == obj.digest("sha256"):
+                    if manifest is not None:
+                        manifest.record(path, stat, digest)
+                    result.unchanged += 1
+                    continue
+        if obj is None and not _valid(entry.name, path, result):
+            continue
+        try:
+            with open(entry.path, "rb") as f:
+                data = f.read()
+            if obj is None:
+                directory.import_file(entry.name, data)
+                if _created(directory, entry.name) is None:
+                    result.failed.append((path, "could not import file"))
+                    continue
+                result.imported += 1
+            else:
+                obj.replace(data)
+                result.replaced += 1
+        except (OSError, ValueError) as e:
+            result.failed.append((path, str(e)))
+            continue
+        result.written += len(data)
+        if manifest is not None:
+            manifest.record(path, stat, hashlib.sha256(data).hexdigest())
+
+    if delete:
+        for name, obj in image.items():
+            _delete(obj, base + "/" + name, manifest, clean, result)
+
+
+# FATX names are ASCII and at most 42 characters long, checked by
+# DirectoryEntry. Records why a name can't be used
+def _valid(name: str, path: str, result):
+    try:
+        DirectoryEntry.new_entry(name, None)
+    except ValueError as e:
+        result.failed.append((path, str(e)))
+        return False
+    return True
+
+
+# the interface only prints why an object could not be created
+def _created(directory, name):
+    try:
+        obj = directory.get(name)
+    except IndexError:
+        return None
+    return None if obj._de.deleted else obj
+
+
+def _delete(obj, path, manifest, clean, result):
+    obj.delete(clean)
+    result.deleted += 1
+    if manifest is not None:
+        manifest.forget(path)
+
+
+def file_hash(path: str):
+    """
+    returns the SHA-256 of a host file as hex string
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
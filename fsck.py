@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import argparse
+from fatx import FATX
+from fatx.fsck import check
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks the consistency of a given image"
+    )
+    parser.add_argument(
+        "--sector-size",
+        dest="sector_size",
+        default=512,
+        type=int,
+        help="sector size used for this image(default: 512)",
+    )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help="memory-map the image instead of reading it cluster by cluster",
+    )
+    parser.add_argument(
+        "--repair",
+        dest="repair",
+        action="store_true",
+        help="fix the problems found, this writes to the image!",
+    )
+    parser.add_argument(
+        "--purge-deleted",
+        dest="purge",
+        action="store_true",
+        help="free the clusters still held by deleted files, they can't be "
+        "recovered afterwards. This writes to the image!",
+    )
+    parser.add_argument(
+        "--json",
+        dest="json",
+        action="store_true",
+        help="print the report as JSON",
+    )
+    parser.add_argument(
+        dest="image", type=str, nargs=1, action="store", help="an FATX filesystem image"
+    )
+    args = parser.parse_args()
+
+    file = args.image[0]
+    if not os.path.exists(file) or os.path.isdir(file):
+        sys.exit("Fatal: fatx-image is not a valid file")
+
+    if args.repair or args.purge:
+        FATX.READ_ONLY = False
+    fs = FATX.Filesystem(file, args.sector_size, args.mmap)
+    report = check(fs, args.repair, args.purge)
+    fs.close()
+    if args.json:
+        print(json.dumps(report.as_dict()))
+    else:
+        print(report)
+    sys.exit(0 if report.clean or args.repair else 1)
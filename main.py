@@ -21,12 +21,24 @@ if __name__ == "__main__":
         type=int,
         help="sector size used for this image(default: 512)",
     )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help="memory-map the image instead of reading it cluster by cluster",
+    )
+    parser.add_argument(
+        "--direct",
+        dest="direct",
+        action="store_true",
+        help="read with O_DIRECT, bypassing the page cache(for block devices)",
+    )
     parser.add_argument(
         dest="image", type=str, nargs=1, action="store", help="an FATX filesystem image"
     )
     args = parser.parse_args()
 
-    fs = FATX.Filesystem(args.image[0], args.sector_size)
+    fs = FATX.Filesystem(args.image[0], args.sector_size, args.mmap, direct=args.direct)
     fs.status()
     root = fs.root
     listfiles(fs.root)
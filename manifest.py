@@ -0,0 +1,119 @@
+import os
+import sys
+import argparse
+from fatx import FATX
+from fatx.manifest import build, duplicates, write
+
+
+def report(groups, f):
+    for group in groups:
+        f.write(
+            "{0} {1} bytes, {2} copies\n".format(group[0].digest, group[0].size, len(group))
+        )
+        for entry in group:
+            f.write("\t{0}\n".format(entry.path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Hashes all files of the given images and reports duplicates"
+    )
+    parser.add_argument(
+        "--sector-size",
+        dest="sector_size",
+        default=512,
+        type=int,
+        help="sector size used for this image(default: 512)",
+    )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help="memory-map the image instead of reading it cluster by cluster",
+    )
+    parser.add_argument(
+        "--algorithm",
+        "-a",
+        dest="algorithm",
+        default="sha256",
+        type=str,
+        help="any hashlib algorithm, or xxh64/xxh3_64/xxh128 if xxhash is installed"
+        "(default: sha256)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        dest="jobs",
+        default=os.cpu_count(),
+        type=int,
+        help="number of files hashed in parallel(default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        dest="output",
+        default=None,
+        type=str,
+        help="write the manifest to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--duplicates",
+        "-d",
+        dest="duplicates",
+        default=None,
+        type=str,
+        help="write the files with the same content to this file, - for stdout",
+    )
+    parser.add_argument(
+        dest="images",
+        type=str,
+        nargs="+",
+        action="store",
+        help="one or more FATX filesystem images",
+    )
+    args = parser.parse_args()
+
+    entries = []
+    failed = []
+    for file in args.images:
+        if not os.path.exists(file) or os.path.isdir(file):
+            sys.exit("Fatal: {0} is not a valid file".format(file))
+        fs = FATX.Filesystem(file, args.sector_size, args.mmap)
+        errors = []
+        try:
+            found = build(fs.root, args.algorithm, args.jobs, errors)
+        except ValueError as e:
+            sys.exit("Fatal: {0}".format(e))
+        finally:
+            fs.close()
+        # paths of several images are told apart by the image
+        if len(args.images) > 1:
+            found = [i._replace(path=file + ":" + i.path) for i in found]
+            errors = [(file + ":" + path, error) for path, error in errors]
+        entries += found
+        failed += errors
+    entries.sort()
+
+    if args.output is None:
+        write(entries, sys.stdout)
+    else:
+        with open(args.output, "w") as f:
+            write(entries, f)
+
+    groups = duplicates(entries)
+    if args.duplicates == "-":
+        report(groups, sys.stdout)
+    elif args.duplicates is not None:
+        with open(args.duplicates, "w") as f:
+            report(groups, f)
+    wasted = sum(group[0].size * (len(group) - 1) for group in groups)
+    print(
+        "{0} files, {1} with duplicates, {2} bytes wasted".format(
+            len(entries), len(groups), wasted
+        ),
+        file=sys.stderr,
+    )
+    for path, error in failed:
+        print("{0}: {1}".format(path, error), file=sys.stderr)
+    if failed:
+        sys.exit("Failed to hash {0} files".format(len(failed)))
@@ -2,6 +2,7 @@ import os
 import sys
 import argparse
 from fatx import FATX
+from fatx.sync import sync, Manifest
 
 
 def walkfs(fs):
@@ -28,7 +29,32 @@ if __name__ == "__main__":
         type=int,
         help="sector size used for this image(default: 512)",
     )
-    parser.add_argument(dest="size", type=int, help="size of the new partition")
+    parser.add_argument(
+        "--sync",
+        dest="sync",
+        action="store_true",
+        help="update an existing image, only changed files are written",
+    )
+    parser.add_argument(
+        "--manifest",
+        dest="manifest",
+        default=None,
+        type=str,
+        help="with --sync, a file recording what was synced, to skip unchanged files",
+    )
+    parser.add_argument(
+        "--keep",
+        dest="keep",
+        action="store_true",
+        help="with --sync, keep files of the image which are missing in src",
+    )
+    parser.add_argument(
+        dest="size",
+        type=int,
+        nargs="?",
+        default=None,
+        help="size of the new partition(not needed when syncing an existing image)",
+    )
     parser.add_argument(
         dest="src",
         type=str,
@@ -50,10 +76,30 @@ if __name__ == "__main__":
     file = args.image[0]
     if not os.path.isdir(src):
         sys.exit("Fatal: src-dir is not a valid directory")
-    if os.path.exists(file):
-        sys.exit("Fatal: target file already exists")
+    if os.path.exists(file) and not args.sync:
+        sys.exit("Fatal: target file already exists, use --sync to update it")
+    if size is None and not (args.sync and os.path.exists(file)):
+        sys.exit("Fatal: the size of the new image is missing")
 
     FATX.READ_ONLY = False
+    if args.sync:
+        if os.path.exists(file):
+            fs = FATX.Filesystem(file, args.sector_size)
+        else:
+            fs = FATX.Filesystem.new(size, file, args.sector_size)
+        manifest = None
+        if args.manifest is not None:
+            manifest = Manifest.load(args.manifest)
+        with fs.batch(fsync=True):
+            result = sync(fs.root, src, manifest, delete=not args.keep)
+        if manifest is not None:
+            manifest.save(args.manifest)
+        fs.close()
+        print(result)
+        sys.exit(1 if result.failed else 0)
+
     fs = FATX.Filesystem.new(size, file, args.sector_size)
     os.chdir(src)
-    walkfs(fs.root)
+    # write the FAT and all directories once at the end instead of per file
+    with fs.batch(fsync=True):
+        walkfs(fs.root)
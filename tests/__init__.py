@@ -0,0 +1,30 @@
+import os, shutil, tempfile
+from fatx import FATX
+from fatx.FATX import Filesystem
+
+
+class ImageTestMixin:
+	"""
+	Creates a fresh 4 MiB image at self.path, inside the temporary directory
+	self.dir, for every test. populate fills it, by default with small.bin
+	and dir/big.bin, override it for other content.
+	"""
+	SMALL = b'snake' * 10
+	BIG = bytes(range(256)) * 200
+
+	def setUp(self):
+		FATX.READ_ONLY = False
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'test.img')
+		fs = Filesystem.new(4 * 1024 * 1024, self.path)
+		self.populate(fs)
+		fs.close()
+
+	def tearDown(self):
+		FATX.READ_ONLY = True
+		shutil.rmtree(self.dir)
+
+	def populate(self, fs):
+		fs.root.import_file('small.bin', self.SMALL)
+		fs.root.create_dir('dir')
+		fs.root.get('dir').import_file('big.bin', self.BIG)
@@ -1,10 +1,307 @@
-import unittest, struct
+import os, unittest, struct
+from fatx import FATX
 from fatx.FATX import Filesystem
+from fatx.blocks import DirectoryEntry, EntryType
+from tests import ImageTestMixin
 
 
-class TestFilesystem(unittest.TestCase):
-	def setUp(self):
-		pass
-
+class TestFilesystem(ImageTestMixin, unittest.TestCase):
 	def test_init(self):
-		pass
+		fs = Filesystem(self.path)
+		self.assertEqual(['small.bin', 'dir'], [str(i) for i in fs.root.ls()])
+		self.assertEqual(b'snake' * 10, fs.root.get('small.bin').export())
+		fs.close()
+
+	def test_read_only(self):
+		FATX.READ_ONLY = True
+		os.chmod(self.path, 0o444)
+		fs = Filesystem(self.path)
+		self.assertEqual('rb', fs.f.mode)
+		self.assertEqual(self.BIG, fs.lookup('/dir/big.bin').export())
+		fs.root.import_file('new.bin', b'new')
+		self.assertLess(0, fs.stats()['counters']['skipped_writes'])
+		fs.close()
+
+	def test_mmap(self):
+		fs = Filesystem(self.path, use_mmap=True)
+		self.assertIsInstance(fs._get_cluster(1), memoryview)
+		big = fs.root.get('dir').get('big.bin')
+		self.assertEqual(bytes(range(256)) * 200, big.export())
+		fs.close()
+
+	def test_close_with_views(self):
+		fs = Filesystem(self.path, use_mmap=True)
+		cluster = fs._get_cluster(1)
+		with self.assertRaises(BufferError):
+			fs.close()
+		self.assertTrue(fs.f.closed)
+		cluster.release()
+
+	def test_open(self):
+		fs = Filesystem(self.path)
+		data = bytes(range(256)) * 200
+		with fs.root.get('dir').get('big.bin').open() as f:
+			self.assertEqual(data[:10], f.read(10))
+			self.assertEqual(10, f.tell())
+			f.seek(16380)
+			self.assertEqual(data[16380:16400], f.read(20))
+			f.seek(-6, 2)
+			self.assertEqual(data[-6:], f.read())
+			f.seek(0)
+			self.assertEqual(data, f.read())
+		fs.close()
+
+	def test_batch(self):
+		fs = Filesystem(self.path)
+		with open(self.path, 'rb') as f:
+			before = f.read(4096 + fs.fat_size + fs.sb.cluster_size)
+		with fs.batch():
+			for i in range(20):
+				fs.root.import_file('file{0}'.format(i), b'x' * 20000)
+			fs.root.create_dir('new')
+			fs.root.get('new').import_file('inner', b'inner')
+			with open(self.path, 'rb') as f:
+				self.assertEqual(before, f.read(len(before)))
+		fs.close()
+		fs = Filesystem(self.path)
+		self.assertEqual(23, len(fs.root.ls()))
+		self.assertEqual(b'x' * 20000, fs.root.get('file19').export())
+		self.assertEqual(b'inner', fs.root.get('new').get('inner').export())
+		fs.close()
+
+	def test_export_to(self):
+		fs = Filesystem(self.path)
+		big = fs.root.get('dir').get('big.bin')
+		out = os.path.join(self.dir, 'big.out')
+		big.export_to(out)
+		with open(out, 'rb') as f:
+			self.assertEqual(bytes(range(256)) * 200, f.read())
+		# without kernel copies, through the buffer
+		unsupported = set(FATX._unsupported)
+		FATX._unsupported.update((FATX._copy_file_range, FATX._sendfile))
+		try:
+			with open(out, 'wb') as f:
+				f.write(b'head')
+				f.flush()
+				big.export_to(f.fileno())
+		finally:
+			FATX._unsupported.clear()
+			FATX._unsupported.update(unsupported)
+		with open(out, 'rb') as f:
+			self.assertEqual(b'head' + bytes(range(256)) * 200, f.read())
+		fs.close()
+
+	def test_new_sparse(self):
+		path = os.path.join(self.dir, 'huge.img')
+		fs = Filesystem.new(64 * 1024 ** 3, path)
+		self.assertEqual(4, fs.fat.size)
+		fs.root.import_file('file', b'data')
+		fs.close()
+		stat = os.stat(path)
+		self.assertEqual(64 * 1024 ** 3, stat.st_size)
+		# superblock, a few FAT pages, root and one data cluster
+		self.assertLess(stat.st_blocks * 512, 1024 ** 2)
+		fs = Filesystem(path)
+		self.assertEqual(b'data', fs.root.get('file').export())
+		fs.close()
+
+	def test_lazy_directories(self):
+		fs = Filesystem(self.path)
+		reads = []
+		read_chain = fs._read_chain
+		fs._read_chain = lambda ID: reads.append(ID) or read_chain(ID)
+		self.assertEqual(2, len(fs.root.ls()))
+		self.assertEqual([], reads)
+		directory = fs.root.get('dir')
+		self.assertEqual([], reads)
+		self.assertEqual(['big.bin'], [str(i) for i in directory.ls()])
+		self.assertEqual(1, len(reads))
+		directory.import_file('more.bin', b'more')
+		self.assertIs(directory, fs.root.get('dir'))
+		self.assertEqual(['big.bin', 'more.bin'], [str(i) for i in directory.ls()])
+		fs.close()
+
+	def test_lookup(self):
+		FATX.READ_ONLY = False
+		fs = Filesystem(self.path)
+		self.assertIs(fs.root, fs.lookup('/'))
+		big = fs.lookup('/dir/big.bin')
+		self.assertEqual('/dir/big.bin', big.path())
+		self.assertIs(big, fs.lookup('dir//big.bin'))
+		self.assertIs(big, fs.root.get('dir').get('big.bin'))
+		with self.assertRaises(IndexError):
+			fs.lookup('/dir/missing')
+		with self.assertRaises(IndexError):
+			fs.lookup('/small.bin/big.bin')
+		fs.lookup('/dir').rename('renamed')
+		with self.assertRaises(IndexError):
+			fs.lookup('/dir/big.bin')
+		self.assertIs(big, fs.lookup('/renamed/big.bin'))
+		big.delete()
+		with self.assertRaises(IndexError):
+			fs.lookup('/renamed/big.bin')
+		fs.lookup('/renamed').import_file('new.bin', b'new')
+		self.assertEqual(b'new', fs.lookup('/renamed/new.bin').export())
+		# a name taken over by another object, after it was looked up
+		fs.root.import_file('a', b'aaa')
+		fs.root.import_file('b', b'bbb')
+		fs.lookup('/a').delete()
+		with self.assertRaises(IndexError):
+			fs.lookup('/a')
+		fs.lookup('/b').rename('a')
+		self.assertEqual(b'bbb', fs.lookup('/a').export())
+		fs.close()
+
+	def test_big_directory(self):
+		path = os.path.join(self.dir, 'big.img')
+		fs = Filesystem.new(64 * 1024 ** 2, path)
+		fs.root.create_dir('dir')
+		directory = fs.root.get('dir')
+		with fs.batch():
+			for i in range(600):
+				directory.import_file('f{0:03d}'.format(i), b'%d' % i)
+		with self.assertRaises(ValueError):
+			fs.import_file(directory._directory(), 'f000', b'again')
+		directory.get('f000').rename('renamed')
+		fs.close()
+		fs = Filesystem(path)
+		directory = fs.root.get('dir')
+		self.assertEqual(600, len(directory.ls()))
+		self.assertEqual(3, len(fs.fat.clusterChain(directory._de.cluster)))
+		self.assertEqual(b'599', fs.lookup('/dir/f599').export())
+		self.assertEqual(b'0', fs.lookup('/dir/renamed').export())
+		fs.close()
+
+	def test_full_directory_cluster(self):
+		fs = Filesystem(self.path)
+		fs.root.create_dir('full')
+		cluster = fs.root.get('full')._de.cluster
+		count = fs.sb.cluster_size // DirectoryEntry.DIRECTORY_SIZE
+		data = b''.join(DirectoryEntry.new_entry('f{0:03d}'.format(i), None).pack() for i in range(count))
+		fs.f.seek(fs._cluster_id_offset(cluster))
+		fs.f.write(data)
+		fs.close()
+		fs = Filesystem(self.path)
+		self.assertEqual(count, len(fs.root.get('full').ls()))
+		self.assertIsNotNone(fs.lookup('/full/f255'))
+		fs.close()
+
+	def test_full_image(self):
+		fs = Filesystem(self.path)
+		# 4 MiB minus superblock and FAT leave 255 clusters
+		self.assertEqual(256, fs.fat.clusters)
+		with self.assertRaises(ValueError):
+			fs.import_file(fs.root._directory(), 'huge', b'x' * 4 * 1024 ** 2)
+		# the failed import must not leave an entry behind
+		fs.root.import_file('after', b'after')
+		fs.root.import_file('fill', b'x' * fs.fat.freeSpace().free * fs.sb.cluster_size)
+		with self.assertRaises(ValueError):
+			fs.create_folder(fs.root._directory(), 'newdir')
+		# writes the root list again
+		fs.root.get('fill').delete(clean=True)
+		fs.close()
+		fs = Filesystem(self.path)
+		self.assertEqual(['small.bin', 'dir', 'after'], [str(i) for i in fs.root.ls()])
+		fs.close()
+
+	def test_truncated_chain(self):
+		fs = Filesystem(self.path)
+		big = fs.lookup('/dir/big.bin')
+		fs.fat.setEntryType(big._de.cluster, EntryType.FATX_CLUSTER_END)
+		# whatever is left is returned, but nothing made up
+		self.assertEqual(self.BIG[:fs.sb.cluster_size], big.export())
+		with self.assertRaises(SystemError):
+			big.open()
+		with self.assertRaises(SystemError):
+			big.digest()
+		with self.assertRaises(SystemError):
+			big.export_to(os.path.join(self.dir, 'big.out'))
+		fs.close()
+
+	def test_broken_directory_chain(self):
+		fs = Filesystem(self.path)
+		fs.fat.setEntryType(fs.root.get('dir')._de.cluster, EntryType.FATX_CLUSTER_AVAILABLE)
+		fs.fat.setEntryType(1, EntryType.FATX_CLUSTER_AVAILABLE)
+		fs._write_fat()
+		fs.close()
+		# only the first cluster of each directory is read then
+		fs = Filesystem(self.path)
+		self.assertEqual(['small.bin', 'dir'], [str(i) for i in fs.root.ls()])
+		self.assertEqual(['big.bin'], [str(i) for i in fs.root.get('dir').ls()])
+		fs.close()
+
+	def test_cluster_cache(self):
+		fs = Filesystem(self.path)
+		small = fs.root.get('small.bin')
+		self.assertEqual(b'snake' * 10, small.export())
+		misses = fs.cache.misses
+		self.assertEqual(b'snake' * 10, small.export())
+		self.assertEqual(misses, fs.cache.misses)
+		self.assertLess(0, fs.cache.hits)
+		fs.root.get('dir').ls()
+		fs.root.get('dir').import_file('new.bin', b'new')
+		# written through, not served from the outdated cluster
+		self.assertIsNotNone(fs.open_directory(fs.root.get('dir')._de).get('new.bin'))
+		fs.close()
+		fs = Filesystem(self.path, cache_size=0)
+		self.assertIsNone(fs.cache)
+		self.assertEqual(b'new', fs.lookup('/dir/new.bin').export())
+		fs.close()
+
+	def test_stats(self):
+		fs = Filesystem(self.path)
+		before = fs.stats()['counters']
+		self.assertEqual({}, fs.stats()['timings'])
+		calls = []
+		fs.trace(lambda op, seconds: calls.append(op))
+		big = fs.lookup('/dir/big.bin')
+		self.assertEqual(bytes(range(256)) * 200, big.export())
+		fs.root.import_file('new.bin', b'new')
+		stats = fs.stats()
+		counters = stats['counters']
+		self.assertLess(before['reads'], counters['reads'])
+		self.assertLessEqual(51200, counters['read_bytes'] - before['read_bytes'])
+		self.assertLess(0, counters['writes'])
+		self.assertEqual(1, counters['fat_flushes'])
+		self.assertEqual(1, counters['directory_flushes'])
+		self.assertIn('cache_hits', counters)
+		self.assertEqual(1, stats['timings']['read_file']['count'])
+		self.assertIn('write_fat', stats['timings'])
+		self.assertIn('read_file', calls)
+		fs.trace(enabled=False)
+		big.export()
+		self.assertEqual(1, fs.stats()['timings']['read_file']['count'])
+		fs.close()
+
+	def test_replace_and_clean_delete(self):
+		fs = Filesystem(self.path)
+		free = fs.fat.freeSpace().free
+		big = fs.lookup('/dir/big.bin')
+		big.replace(b'short')
+		self.assertEqual(free + 3, fs.fat.freeSpace().free)
+		big.replace(b'x' * 40000)
+		self.assertEqual(free + 1, fs.fat.freeSpace().free)
+		fs.root.import_file('empty', b'')
+		self.assertEqual(0, fs.lookup('/empty')._de.cluster)
+		fs.lookup('/dir').delete(clean=True)
+		self.assertEqual(free + 5, fs.fat.freeSpace().free)
+		fs.close()
+		fs = Filesystem(self.path)
+		self.assertEqual(['small.bin', 'empty'], [str(i) for i in fs.root.ls()])
+		self.assertEqual(b'', fs.lookup('/empty').export())
+		fs.close()
+
+	def test_several_images(self):
+		path = os.path.join(self.dir, 'other.img')
+		with Filesystem.new(4 * 1024 * 1024, path) as other:
+			other.root.import_file('small.bin', b'other')
+		with Filesystem(self.path) as fs, Filesystem(path) as other:
+			small = fs.lookup('/small.bin')
+			other_small = other.lookup('/small.bin')
+			self.assertIs(fs, small._filesystem)
+			self.assertIs(other, other_small._filesystem)
+			self.assertEqual(b'snake' * 10, small.export())
+			self.assertEqual(b'other', other_small.export())
+			self.assertIs(fs, fs.lookup('/dir/big.bin')._filesystem)
+		self.assertTrue(fs.f.closed)
+		self.assertTrue(other.f.closed)
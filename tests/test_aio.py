@@ -0,0 +1,57 @@
+import asyncio, hashlib, unittest
+from concurrent.futures import ThreadPoolExecutor
+from fatx.FATX import Filesystem
+from fatx.aio import AsyncFilesystem
+from tests import ImageTestMixin
+
+
+class TestAsyncFilesystem(ImageTestMixin, unittest.IsolatedAsyncioTestCase):
+	def populate(self, fs):
+		with fs.batch():
+			fs.root.import_file('small.bin', self.SMALL)
+			fs.root.create_dir('dir')
+			for i in range(20):
+				fs.root.get('dir').import_file('big{0}.bin'.format(i), self.BIG)
+
+	async def test_lookup(self):
+		async with await AsyncFilesystem.open(self.path) as afs:
+			small = await afs.alookup('/small.bin')
+			self.assertEqual(b'snake' * 10, await afs.aread(small))
+			with self.assertRaises(IndexError):
+				await afs.alookup('/missing')
+			names = [str(i) async for i in afs.iterdir(afs.root)]
+			self.assertEqual(['small.bin', 'dir'], names)
+			paths = [i.path() async for i in afs.walk()]
+			self.assertEqual(22, len(paths))
+			self.assertIn('/dir/big19.bin', paths)
+
+	async def test_chunks(self):
+		async with await AsyncFilesystem.open(self.path, limit=2) as afs:
+			big = await afs.alookup('/dir/big0.bin')
+			chunks = [i async for i in afs.chunks(big, 5000)]
+			self.assertEqual(11, len(chunks))
+			self.assertEqual(self.BIG, b''.join(chunks))
+
+	async def test_concurrent(self):
+		executor = ThreadPoolExecutor(4)
+		afs = await AsyncFilesystem.open(self.path, executor=executor, limit=4)
+		directory = await afs.alookup('/dir')
+		files = await afs.als(directory)
+		data = await asyncio.gather(*[afs.aread(i) for i in files])
+		self.assertEqual([self.BIG] * 20, data)
+		digests = await asyncio.gather(*[afs.adigest(i) for i in files])
+		self.assertEqual({hashlib.sha256(self.BIG).hexdigest()}, set(digests))
+		await afs.close()
+		# a shared pool is left running
+		self.assertEqual(1, executor.submit(lambda: 1).result())
+		executor.shutdown()
+
+	async def test_created_outside_the_loop(self):
+		# e.g. in a thread without a loop, or before the loop of a service runs
+		fs = Filesystem(self.path)
+		loop = asyncio.get_running_loop()
+		afs = await loop.run_in_executor(None, AsyncFilesystem, fs, None, 2)
+		files = await afs.als(await afs.alookup('/dir'))
+		data = await asyncio.gather(*[afs.aread(i) for i in files])
+		self.assertEqual([self.BIG] * 20, data)
+		await afs.close()
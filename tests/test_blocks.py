@@ -1,5 +1,5 @@
-import unittest, struct
-from fatx.blocks import SuperBlock, FAT, DirectoryEntry, DirectoryEntryList, EntryType
+import unittest, struct, random
+from fatx.blocks import SuperBlock, FAT, FreeSpace, DirectoryEntry, DirectoryEntryList, EntryType
 
 
 class TestSuperBlock(unittest.TestCase):
@@ -59,6 +59,13 @@ class TestFAT(unittest.TestCase):
 		self.fat = FAT(self.bytes*3)
 		self.assertEqual(4, self.fat.size)
 
+	def test_compact_clustermap(self):
+		self.assertEqual(2, self.fat.clustermap.itemsize)
+		self.assertEqual(4, FAT(self.bytes*3).clustermap.itemsize)
+		fat = FAT(memoryview(self.bytes))
+		self.assertEqual(self.fat.clustermap, fat.clustermap)
+		self.assertEqual(0x0005, fat.clustermap[0x0004])
+
 	def test_getEntryType(self):
 		self.assertEqual(EntryType.FATX_CLUSTER_AVAILABLE, self.fat.getEntryType(0x0000))
 		self.assertEqual(EntryType.FATX_CLUSTER_END, self.fat.getEntryType(0xFFFF))
@@ -92,6 +99,31 @@ class TestFAT(unittest.TestCase):
 		with self.assertRaises(SystemError):
 			self.fat.clusterChain(0x0004)
 
+	def test_clusterChain_loop(self):
+		self.fat.clustermap[0x0004 + 339] = 0x0004
+		with self.assertRaises(SystemError):
+			self.fat.clusterChain(0x0004)
+
+	def test_clusterChain_memoized(self):
+		self.assertEqual(340, len(self.fat.clusterChain(0x0004)))
+		self.assertEqual(1, len(self.fat._chains))
+		# allocations elsewhere keep the chain
+		self.fat.linkClusterChain(self.fat.getFreeClusterChain(3))
+		self.assertEqual(1, len(self.fat._chains))
+		# changing a member drops it
+		self.fat.setEntryType(0x0004 + 100, EntryType.FATX_CLUSTER_END)
+		self.assertEqual(0, len(self.fat._chains))
+		self.assertEqual(101, len(self.fat.clusterChain(0x0004)))
+		self.fat.extendClusterChain([0x0004 + 100], [0x0004 + 101])
+		self.assertEqual(102, len(self.fat.clusterChain(0x0004)))
+
+	def test_clusterExtents(self):
+		self.assertEqual([(0x0004, 340)], self.fat.clusterExtents(0x0004))
+
+	def test_chainExtents(self):
+		self.assertEqual([], FAT.chainExtents([]))
+		self.assertEqual([(1, 3), (7, 2), (5, 1)], FAT.chainExtents([1, 2, 3, 7, 8, 5]))
+
 	def test_freeClusterChain(self):
 		chain = self.fat.clusterChain(0x0004)
 		self.fat.freeClusterChain(chain)
@@ -109,7 +141,8 @@ class TestFAT(unittest.TestCase):
 		self.assertEqual(test_chain, chain)
 
 	def test_sliced_getFreeClusterChain(self):
-		test_chain = [10205, 10208, 10209, 10210, 10211]
+		# a contiguous run is preferred over filling the gap
+		test_chain = [10208, 10209, 10210, 10211, 10212]
 		self.fat.clustermap[10206] = 0x1111
 		self.fat.clustermap[10207] = 0x1111
 		chain = self.fat.getFreeClusterChain(5)
@@ -117,6 +150,49 @@ class TestFAT(unittest.TestCase):
 		for i in chain:
 			self.assertEqual(0x0000, self.fat.clustermap[i])
 		self.assertEqual(test_chain, chain)
+		self.assertEqual([10205], self.fat.getFreeClusterChain(1))
+
+	def test_fragmented_getFreeClusterChain(self):
+		for i in range(10205, 32768, 3):
+			self.fat.clustermap[i] = 0x1111
+		chain = self.fat.getFreeClusterChain(5)
+		self.assertEqual(5, len(chain))
+		self.assertEqual(len(chain), len(set(chain)))
+		for i in chain:
+			self.assertEqual(0x0000, self.fat.clustermap[i])
+
+	def test_full_getFreeClusterChain(self):
+		free = self.fat.freeSpace().free
+		self.assertEqual(32768 - 10205, free)
+		with self.assertRaises(ValueError):
+			self.fat.getFreeClusterChain(free + 1)
+
+	def test_freeSpace_updates(self):
+		chain = self.fat.getFreeClusterChain(3)
+		self.fat.linkClusterChain(chain)
+		self.assertEqual([(10208, 32768 - 10208)], self.fat.freeSpace().runs())
+		self.fat.freeClusterChain(chain)
+		self.assertEqual([(10205, 32768 - 10205)], self.fat.freeSpace().runs())
+		self.fat.freeClusterChain(self.fat.clusterChain(0x0004))
+		self.assertEqual((0x0004, 340), self.fat.freeSpace().runs()[0])
+		self.fat.setEntryType(0x0005, EntryType.FATX_CLUSTER_BAD)
+		self.assertEqual([(0x0004, 1), (0x0006, 338)], self.fat.freeSpace().runs()[:2])
+
+	def test_freeSpace_random(self):
+		# the index has to match the table after any mix of allocations and frees
+		rnd = random.Random(0)
+		chains = []
+		for i in range(300):
+			if chains and rnd.random() < 0.4:
+				self.fat.freeClusterChain(chains.pop(rnd.randrange(len(chains))))
+			else:
+				chain = self.fat.getFreeClusterChain(rnd.choice((1, 1, 2, 7, 40)))
+				self.fat.linkClusterChain(chain)
+				chains.append(chain)
+			if i % 50 == 0:
+				self.fat.setEntryType(rnd.choice(self.fat.freeSpace().runs())[0] + 1, EntryType.FATX_CLUSTER_BAD)
+		self.assertEqual(FreeSpace(self.fat.clustermap, 32768).runs(), self.fat.freeSpace().runs())
+		self.assertEqual(self.fat.clustermap.tolist().count(0), self.fat.freeSpace().free)
 
 	def test_linkClusterChain(self):
 		test_chain = [10205, 10206, 10207]
@@ -125,11 +201,30 @@ class TestFAT(unittest.TestCase):
 		self.assertEqual(10207, self.fat.clustermap[10206])
 		self.assertEqual(0xFFFF, self.fat.clustermap[10207])
 
+	def test_new(self):
+		fat = FAT.new(65536)
+		self.assertEqual(2, fat.size)
+		self.assertEqual(32768, fat.numberClusters())
+		self.assertEqual([0xFFF8, 0xFFFF, 0x0000], list(fat.clustermap[:3]))
+		self.assertEqual([(0, b'\xF8\xFF\xFF\xFF' + b'\x00' * 4092)], fat.packDirty())
+		self.assertEqual(4, FAT.new(65536 * 3).size)
+
 	def test_pack(self):
 		b = self.fat.pack()
 		self.assertEqual(65536, len(b))
 		self.assertEqual(self.bytes, b)
 
+	def test_packDirty(self):
+		self.assertEqual([], self.fat.packDirty())
+		# pages 2 and 3, adjacent, and page 6
+		self.fat.setEntryType(2048 * 2, EntryType.FATX_CLUSTER_BAD)
+		self.fat.setEntryType(2048 * 4 - 1, EntryType.FATX_CLUSTER_BAD)
+		self.fat.setEntryType(2048 * 6, EntryType.FATX_CLUSTER_BAD)
+		dirty = self.fat.packDirty()
+		b = self.fat.pack()
+		self.assertEqual([(4096 * 2, b[4096 * 2:4096 * 4]), (4096 * 6, b[4096 * 6:4096 * 7])], dirty)
+		self.assertEqual([], self.fat.packDirty())
+
 
 class TestDirectoryEntry(unittest.TestCase):
 	def pack(self):
@@ -218,6 +313,31 @@ class TestDirectoryEntry(unittest.TestCase):
 		self.assertTrue(de.atr.DIRECTORY)
 		self.assertTrue(de.atr.DELETED)
 
+	def test_lazy_decoding(self):
+		self.attributes = DirectoryEntry.ATR_DIRECTORY
+		self.file = self.pack()
+		de = DirectoryEntry(memoryview(self.file), 0)
+		self.assertIsNone(de._filename)
+		self.assertIsNone(de._atr)
+		self.assertTrue(de.is_directory)
+		self.assertFalse(de.deleted)
+		self.assertIsNone(de._atr)
+		self.assertEqual(self.file, de.pack())
+		self.assertEqual(self.filename, de.filename)
+		self.assertTrue(de.atr.DIRECTORY)
+		with self.assertRaises(AttributeError):
+			de.something = 1
+
+	def test_deleted(self):
+		self.namesize = 0xE5
+		self.file = self.pack()
+		de = DirectoryEntry(self.file, 0)
+		self.assertTrue(de.deleted)
+		self.assertTrue(de.atr.DELETED)
+		self.assertEqual(self.filename, de.filename)
+		self.assertEqual(self.file, de.pack())
+		self.assertEqual(42, de.namesize)
+
 	def test_new(self):
 		self.filename = 'NewEntry'
 		self.namesize = len(self.filename)
@@ -253,15 +373,22 @@ class TestDirectoryEntryList(unittest.TestCase):
 			DirectoryEntryList(self.data, 0)
 
 	def test_missing_termination(self):
-		self.data = DirectoryEntry.new_entry("Entry", None).pack()
-		self.data *= 5
-		with self.assertRaises(SystemError):
-			DirectoryEntryList(self.data, 0)
+		# a list filling all of its clusters has no room for one
+		self.data = b''.join(DirectoryEntry.new_entry("Entry {0}".format(i), None).pack() for i in range(5))
+		el = DirectoryEntryList(self.data, 0)
+		self.assertEqual(5, len(el.list()))
+		self.assertEqual("Entry 4", el.list()[-1].filename)
 
 	def test_trailing_data(self):
 		self.data += DirectoryEntry.new_entry("Entry", None).pack()*5
 		self.assertEqual(100, len(DirectoryEntryList(self.data, 0)._l))
 
+	def test_lazy_names(self):
+		el = DirectoryEntryList(self.data, 0)
+		self.assertEqual([None] * 100, [de._filename for de in el.list()])
+		self.assertIs(el.list()[42], el.get("Entry 42"))
+		self.assertEqual("Entry 00", el.list()[0]._filename)
+
 	def test_list(self):
 		el = DirectoryEntryList(self.data, 0)
 		self.assertEqual(100, len(el.list()))
@@ -273,9 +400,35 @@ class TestDirectoryEntryList(unittest.TestCase):
 		self.assertEqual(101, len(el.list()))
 		self.assertIn(de, el.list())
 
+	def test_append_duplicate(self):
+		el = DirectoryEntryList(self.data, 0)
+		with self.assertRaises(ValueError):
+			el.append(DirectoryEntry.new_entry("Entry 42", None))
+		el.delete(el.get("Entry 42"))
+		el.append(DirectoryEntry.new_entry("Entry 42", None))
+		self.assertEqual(101, len(el.list()))
+		self.assertEqual(42, el.first_changed)
+
+	def test_rename(self):
+		el = DirectoryEntryList(self.data, 0)
+		de = el.get("Entry 07")
+		with self.assertRaises(ValueError):
+			el.rename(de, "Entry 08")
+		el.rename(de, "Seven")
+		self.assertIs(de, el.get("Seven"))
+		self.assertIsNone(el.get("Entry 07"))
+		self.assertEqual(7, el.first_changed)
+
+	def test_many_entries(self):
+		el = DirectoryEntryList(self.data, 0)
+		for i in range(100, 1000):
+			el.append(DirectoryEntry.new_entry("Entry {:03d}".format(i), None))
+		self.assertEqual(1000, len(DirectoryEntryList(el.pack(), 0).list()))
+
 	def test_pack(self):
 		el = DirectoryEntryList(self.data, 0)
 		self.assertEqual(self.data, el.pack())
+		self.assertEqual(self.data[64 * 90:], el.pack(90))
 
 		de = DirectoryEntry.new_entry("New", None)
 		el.append(de)
@@ -0,0 +1,35 @@
+import unittest
+from fatx.cache import ClusterCache
+
+
+class TestClusterCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = ClusterCache(3 * 16)
+
+	def test_get(self):
+		self.assertIsNone(self.cache.get(1))
+		self.cache.put(1, b'a' * 16)
+		self.assertEqual(b'a' * 16, self.cache.get(1))
+		self.assertEqual(1, self.cache.hits)
+		self.assertEqual(1, self.cache.misses)
+
+	def test_bounded(self):
+		for i in range(1, 5):
+			self.cache.put(i, bytes([i]) * 16)
+		self.assertEqual(3, len(self.cache))
+		self.assertEqual(3 * 16, self.cache.size)
+		self.assertIsNone(self.cache.get(1))
+		# recently used clusters stay
+		self.cache.get(2)
+		self.cache.put(5, b'5' * 16)
+		self.assertIsNotNone(self.cache.get(2))
+		self.assertIsNone(self.cache.get(3))
+		self.cache.put(6, b'6' * 64)
+		self.assertIsNone(self.cache.get(6))
+
+	def test_invalidate(self):
+		self.cache.put(1, b'a' * 16)
+		self.cache.invalidate(1)
+		self.cache.invalidate(2)
+		self.assertIsNone(self.cache.get(1))
+		self.assertEqual(0, self.cache.size)
@@ -0,0 +1,48 @@
+import os, unittest
+from fatx.FATX import Filesystem
+from fatx.blocks import EntryType
+from fatx.extract import extract
+from tests import ImageTestMixin
+
+
+class TestExtract(ImageTestMixin, unittest.TestCase):
+	def setUp(self):
+		super().setUp()
+		self.dest = os.path.join(self.dir, 'out')
+		os.mkdir(self.dest)
+
+	def populate(self, fs):
+		with fs.batch():
+			fs.root.import_file('small.bin', self.SMALL)
+			fs.root.create_dir('dir')
+			fs.root.get('dir').create_dir('sub')
+			fs.root.get('dir').get('sub').import_file('big.bin', self.BIG)
+
+	def test_extract(self):
+		fs = Filesystem(self.path)
+		cwd = os.getcwd()
+		self.assertEqual(2, extract(fs.root, self.dest, 4))
+		self.assertEqual(cwd, os.getcwd())
+		fs.close()
+		with open(os.path.join(self.dest, 'small.bin'), 'rb') as f:
+			self.assertEqual(b'snake' * 10, f.read())
+		with open(os.path.join(self.dest, 'dir', 'sub', 'big.bin'), 'rb') as f:
+			self.assertEqual(bytes(range(256)) * 200, f.read())
+
+	def test_failures(self):
+		fs = Filesystem(self.path)
+		# names from a crafted image must not leave dest
+		fs.root.import_file('..', b'escape')
+		fs.root.get('dir').import_file('a/b', b'escape')
+		small = fs.root.get('small.bin')._de.cluster
+		fs.fat.setEntryType(small, EntryType.FATX_CLUSTER_AVAILABLE)
+		failed = []
+		self.assertEqual(1, extract(fs.root, self.dest, 4, failed))
+		fs.close()
+		self.assertEqual(
+			['/..', '/dir/a/b', '/small.bin'], [path for path, error in failed])
+		self.assertIn('ValueError', failed[2][1])
+		self.assertEqual(['dir'], os.listdir(self.dest))
+		self.assertEqual(['out', 'test.img'], sorted(os.listdir(self.dir)))
+		with open(os.path.join(self.dest, 'dir', 'sub', 'big.bin'), 'rb') as f:
+			self.assertEqual(bytes(range(256)) * 200, f.read())
@@ -0,0 +1,110 @@
+import unittest
+from fatx.FATX import Filesystem
+from fatx.blocks import EntryType
+from fatx.fsck import check
+from tests import ImageTestMixin
+
+
+class TestFsck(ImageTestMixin, unittest.TestCase):
+	def setUp(self):
+		super().setUp()
+		self.fs = Filesystem(self.path)
+		self.small = self.fs.fat.clusterChain(self.fs.root.get('small.bin')._de.cluster)
+		self.big = self.fs.fat.clusterChain(self.fs.lookup('/dir/big.bin')._de.cluster)
+
+	def tearDown(self):
+		self.fs.close()
+		super().tearDown()
+
+	def link(self, cluster, pointer):
+		self.fs.fat.setEntryType(cluster, EntryType.FATX_CLUSTER_AVAILABLE)
+		self.fs.fat.setEntryType(cluster, pointer)
+
+	def recheck(self):
+		self.fs.close()
+		self.fs = Filesystem(self.path)
+		return check(self.fs)
+
+	def test_clean(self):
+		report = check(self.fs)
+		self.assertTrue(report.clean)
+		self.assertEqual(2, report.files)
+		self.assertEqual(2, report.directories)
+		self.assertEqual(0, report.lost)
+		# root, dir, small.bin and the four clusters of big.bin
+		self.assertEqual(7, report.used)
+		self.assertEqual(255 - 7, report.free)
+
+	def test_orphans(self):
+		chain = self.fs.fat.getFreeClusterChain(3)
+		self.fs.fat.linkClusterChain(chain)
+		self.link(chain[-1] + 1, chain[-1] + 2)
+		self.link(chain[-1] + 2, chain[-1] + 1)
+		report = check(self.fs)
+		self.assertEqual([(chain[0], 3)], report.orphans)
+		self.assertEqual([(chain[-1] + 1, 2)], report.orphan_loops)
+		self.assertEqual(5, report.lost)
+		self.assertFalse(report.clean)
+		check(self.fs, repair=True)
+		self.assertTrue(self.recheck().clean)
+
+	def test_loop(self):
+		self.link(self.big[-1], self.big[1])
+		report = check(self.fs)
+		self.assertEqual([('/dir/big.bin', self.big[1])], report.loops)
+		check(self.fs, repair=True)
+		report = self.recheck()
+		self.assertTrue(report.clean)
+		self.assertEqual(bytes(range(256)) * 200, self.fs.lookup('/dir/big.bin').export())
+
+	def test_crosslink(self):
+		self.link(self.small[-1], self.big[1])
+		report = check(self.fs)
+		self.assertEqual([('/dir/big.bin', self.big[1])], report.crosslinks)
+		self.assertEqual([('/small.bin', 50, 4)], report.size_mismatches)
+		check(self.fs, repair=True)
+		report = self.recheck()
+		self.assertTrue(report.clean)
+		self.assertEqual(b'snake' * 10, self.fs.lookup('/small.bin').export())
+		big = self.fs.lookup('/dir/big.bin')
+		self.assertEqual(self.fs.sb.cluster_size, big._de.size)
+
+	def test_broken(self):
+		self.fs.fat.setEntryType(self.big[2], EntryType.FATX_CLUSTER_AVAILABLE)
+		report = check(self.fs)
+		self.assertEqual([('/dir/big.bin', self.big[1])], report.broken)
+		self.assertEqual([(self.big[3], 1)], report.orphans)
+		check(self.fs, repair=True)
+		self.assertTrue(self.recheck().clean)
+		self.assertEqual(2 * self.fs.sb.cluster_size, self.fs.lookup('/dir/big.bin')._de.size)
+
+	def test_deleted(self):
+		directory = self.fs.lookup('/dir')
+		directory.delete()
+		report = check(self.fs)
+		self.assertTrue(report.clean)
+		self.assertEqual(0, report.lost)
+		self.assertEqual(
+			[('/dir', directory._de.cluster, 1), ('/dir/big.bin', self.big[0], 4)],
+			report.deleted)
+		# repair keeps them recoverable
+		check(self.fs, repair=True)
+		report = self.recheck()
+		self.assertEqual(2, len(report.deleted))
+		check(self.fs, purge=True)
+		report = self.recheck()
+		self.assertTrue(report.clean)
+		self.assertEqual([], report.deleted)
+		self.assertEqual(255 - 2, report.free)
+
+	def test_broken_root(self):
+		self.fs.fat.setEntryType(1, EntryType.FATX_CLUSTER_AVAILABLE)
+		self.fs._write_fat()
+		report = self.recheck()
+		self.assertEqual([('/', 1)], report.broken)
+		self.assertEqual(2, report.files)
+		self.assertEqual(0, report.lost)
+		check(self.fs, repair=True)
+		report = self.recheck()
+		self.assertTrue(report.clean)
+		self.assertEqual(b'snake' * 10, self.fs.lookup('/small.bin').export())
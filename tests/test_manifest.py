@@ -0,0 +1,69 @@
+import io, hashlib, unittest
+from fatx import FATX
+from fatx.FATX import Filesystem
+from fatx.blocks import EntryType
+from fatx.manifest import build, duplicates, write, read, Entry
+from tests import ImageTestMixin
+
+
+class TestManifest(ImageTestMixin, unittest.TestCase):
+	def populate(self, fs):
+		with fs.batch():
+			fs.root.import_file('small.bin', self.SMALL)
+			fs.root.import_file('empty.bin', b'')
+			fs.root.create_dir('dir')
+			fs.root.get('dir').import_file('big.bin', self.BIG)
+			fs.root.get('dir').import_file('copy.bin', self.BIG)
+			fs.root.get('dir').import_file('small.bin', self.SMALL)
+
+	def test_build(self):
+		for use_mmap in (False, True):
+			fs = Filesystem(self.path, use_mmap=use_mmap)
+			entries = build(fs.root, jobs=4)
+			self.assertEqual(
+				['/dir/big.bin', '/dir/copy.bin', '/dir/small.bin', '/empty.bin', '/small.bin'],
+				[i.path for i in entries])
+			big = entries[0]
+			self.assertEqual(len(self.BIG), big.size)
+			self.assertEqual(fs.lookup('/dir/big.bin')._de.cluster, big.cluster)
+			self.assertEqual(hashlib.sha256(self.BIG).hexdigest(), big.digest)
+			self.assertEqual(hashlib.sha256(b'').hexdigest(), entries[3].digest)
+			fs.close()
+
+	def test_algorithm(self):
+		fs = Filesystem(self.path)
+		entries = build(fs.root, 'md5')
+		self.assertEqual(hashlib.md5(self.BIG).hexdigest(), entries[0].digest)
+		with self.assertRaises(ValueError):
+			build(fs.root, 'no-such-hash')
+		if FATX.xxhash is None:
+			with self.assertRaises(ValueError):
+				build(fs.root, 'xxh64')
+		fs.close()
+
+	def test_duplicates(self):
+		fs = Filesystem(self.path)
+		entries = build(fs.root)
+		fs.close()
+		groups = duplicates(entries)
+		self.assertEqual(
+			[['/dir/big.bin', '/dir/copy.bin'], ['/dir/small.bin', '/small.bin']],
+			[[i.path for i in group] for group in groups])
+
+	def test_failures(self):
+		fs = Filesystem(self.path)
+		big = fs.lookup('/dir/big.bin')._de.cluster
+		fs.fat.setEntryType(big, EntryType.FATX_CLUSTER_AVAILABLE)
+		failed = []
+		entries = build(fs.root, jobs=4, failed=failed)
+		fs.close()
+		self.assertEqual(4, len(entries))
+		self.assertEqual(['/dir/big.bin'], [path for path, error in failed])
+
+	def test_write(self):
+		entries = [Entry('/a b', 3, 5, 'ff'), Entry('/c', 0, 0, '00')]
+		f = io.StringIO()
+		write(entries, f)
+		self.assertEqual('/a b\t3\t5\tff\n/c\t0\t0\t00\n', f.getvalue())
+		f.seek(0)
+		self.assertEqual(entries, read(f))
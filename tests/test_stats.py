@@ -0,0 +1,44 @@
+import unittest
+from fatx.stats import Histogram, Stats, timed
+
+
+class Timed:
+	def __init__(self):
+		self._stats = Stats()
+
+	@timed('op')
+	def op(self, value):
+		return value
+
+
+class TestStats(unittest.TestCase):
+	def test_histogram(self):
+		h = Histogram()
+		h.add(0.0000005)
+		h.add(0.000003)
+		h.add(0.000003)
+		h.add(100000.0)
+		d = h.as_dict()
+		self.assertEqual(4, d['count'])
+		self.assertEqual(100000.0, d['max'])
+		self.assertEqual({1: 1, 4: 2, 2 ** 31: 1}, d['buckets'])
+
+	def test_timed(self):
+		t = Timed()
+		self.assertEqual(1, t.op(1))
+		self.assertEqual({}, t._stats.histograms)
+		calls = []
+		t._stats.timing = True
+		t._stats.hook = lambda op, seconds: calls.append(op)
+		self.assertEqual(2, t.op(2))
+		self.assertEqual(1, t._stats.histograms['op'].count)
+		self.assertEqual(['op'], calls)
+
+	def test_counters(self):
+		s = Stats()
+		s.count('reads')
+		s.count('read_bytes', 100)
+		self.assertEqual(1, s.as_dict()['counters']['reads'])
+		self.assertEqual(100, s.as_dict()['counters']['read_bytes'])
+		s.reset()
+		self.assertEqual(0, s.as_dict()['counters']['reads'])
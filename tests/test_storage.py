@@ -0,0 +1,64 @@
+import os, shutil, tempfile, unittest
+from fatx import FATX
+from fatx.FATX import Filesystem
+from fatx.storage import DirectReader, device_size
+
+
+class TestDirectReader(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'data.bin')
+		self.data = os.urandom(3 * 1024 * 1024 + 123)
+		with open(self.path, 'wb') as f:
+			f.write(self.data)
+		try:
+			self.reader = DirectReader(self.path)
+			self.reader.read(0, 1)
+		except OSError as e:
+			shutil.rmtree(self.dir)
+			self.skipTest('O_DIRECT not supported here: {0}'.format(e))
+
+	def tearDown(self):
+		self.reader.close()
+		shutil.rmtree(self.dir)
+
+	def test_size(self):
+		self.assertEqual(len(self.data), self.reader.size)
+		with open(self.path, 'rb') as f:
+			self.assertEqual(len(self.data), device_size(f.fileno()))
+
+	def test_read_unaligned(self):
+		self.assertEqual(self.data[:10], self.reader.read(0, 10))
+		self.assertEqual(self.data[4095:4097], self.reader.read(4095, 2))
+		self.assertEqual(self.data[1000:2 * 1024 * 1024 + 7], self.reader.read(1000, 2 * 1024 * 1024 - 993))
+		self.assertEqual(self.data[-100:], self.reader.read(len(self.data) - 100, 200))
+
+	def test_copy_to(self):
+		out = os.path.join(self.dir, 'out.bin')
+		fd = os.open(out, os.O_WRONLY | os.O_CREAT)
+		try:
+			self.reader.copy_to(777, len(self.data) - 777, fd)
+		finally:
+			os.close(fd)
+		with open(out, 'rb') as f:
+			self.assertEqual(self.data[777:], f.read())
+
+	def test_filesystem(self):
+		FATX.READ_ONLY = False
+		try:
+			image = os.path.join(self.dir, 'test.img')
+			fs = Filesystem.new(4 * 1024 * 1024, image)
+			fs.root.create_dir('dir')
+			fs.root.get('dir').import_file('file', self.data[:100000])
+			fs.close()
+		finally:
+			FATX.READ_ONLY = True
+		fs = Filesystem(image, direct=True)
+		self.assertEqual(self.data[:100000], fs.lookup('/dir/file').export())
+		out = os.path.join(self.dir, 'file')
+		fs.lookup('/dir/file').export_to(out)
+		with open(out, 'rb') as f:
+			self.assertEqual(self.data[:100000], f.read())
+		fs.close()
+		with self.assertRaises(ValueError):
+			Filesystem(image, use_mmap=True, direct=True)
@@ -0,0 +1,99 @@
+import os, shutil, unittest
+from fatx.FATX import Filesystem
+from fatx.fsck import check
+from fatx.sync import sync, Manifest
+from tests import ImageTestMixin
+
+
+class TestSync(ImageTestMixin, unittest.TestCase):
+	def setUp(self):
+		super().setUp()
+		self.src = os.path.join(self.dir, 'src')
+		os.makedirs(os.path.join(self.src, 'dir', 'sub'))
+		self.write('small.bin', b'snake' * 10)
+		self.write('empty.bin', b'')
+		self.write('dir/big.bin', bytes(range(256)) * 200)
+		self.write('dir/sub/inner.bin', b'inner')
+
+	# the image starts empty, everything comes from src
+	def populate(self, fs):
+		pass
+
+	def write(self, name, data):
+		with open(os.path.join(self.src, name), 'wb') as f:
+			f.write(data)
+
+	def sync(self, manifest=None):
+		fs = Filesystem(self.path)
+		with fs.batch():
+			result = sync(fs.root, self.src, manifest)
+		fs.close()
+		fs = Filesystem(self.path)
+		self.assertTrue(check(fs).clean)
+		return fs, result
+
+	def test_sync(self):
+		fs, result = self.sync()
+		self.assertEqual((4, 2), (result.imported, result.directories))
+		self.assertEqual(b'', fs.lookup('/empty.bin').export())
+		self.assertEqual(b'inner', fs.lookup('/dir/sub/inner.bin').export())
+		free = fs.fat.freeSpace().free
+		fs.close()
+
+		fs, result = self.sync()
+		self.assertEqual((0, 0, 4), (result.imported, result.replaced, result.unchanged))
+		fs.close()
+
+		self.write('small.bin', b'SNAKE' * 10)
+		self.write('dir/big.bin', b'shrunk')
+		os.remove(os.path.join(self.src, 'dir', 'sub', 'inner.bin'))
+		os.rmdir(os.path.join(self.src, 'dir', 'sub'))
+		fs, result = self.sync()
+		self.assertEqual((2, 1, 1), (result.replaced, result.deleted, result.unchanged))
+		self.assertEqual(b'SNAKE' * 10, fs.lookup('/small.bin').export())
+		self.assertEqual(b'shrunk', fs.lookup('/dir/big.bin').export())
+		self.assertEqual(['big.bin'], [str(i) for i in fs.lookup('/dir').ls()])
+		# big.bin lost three clusters, sub and inner.bin one each
+		self.assertEqual(free + 5, fs.fat.freeSpace().free)
+		fs.close()
+
+		self.write('dir/big.bin', bytes(range(256)) * 300)
+		fs, result = self.sync()
+		self.assertEqual(1, result.replaced)
+		self.assertEqual(bytes(range(256)) * 300, fs.lookup('/dir/big.bin').export())
+		fs.close()
+
+	def test_manifest(self):
+		path = os.path.join(self.dir, 'manifest.json')
+		manifest = Manifest.load(path)
+		fs, result = self.sync(manifest)
+		manifest.save(path)
+		self.assertEqual(4, len(manifest.files))
+		fs.close()
+
+		manifest = Manifest.load(path)
+		fs = Filesystem(self.path)
+		reads = fs.stats()['counters']['reads']
+		result = sync(fs.root, self.src, manifest)
+		self.assertEqual(4, result.unchanged)
+		# only the directories were read, no file content
+		self.assertEqual(reads + 2, fs.stats()['counters']['reads'])
+		fs.close()
+
+		shutil.rmtree(os.path.join(self.src, 'dir'))
+		fs, result = self.sync(manifest)
+		self.assertEqual(1, result.deleted)
+		self.assertEqual(['/empty.bin', '/small.bin'], sorted(manifest.files))
+		fs.close()
+
+	def test_failed(self):
+		self.write('café.txt', b'cafe')
+		self.write('n' * 50, b'long')
+		os.mkdir(os.path.join(self.src, 'd' * 43))
+		fs, result = self.sync()
+		self.assertEqual(4, result.imported)
+		self.assertEqual(
+			['/café.txt', '/' + 'd' * 43, '/' + 'n' * 50],
+			[path for path, error in result.failed])
+		self.assertIn('3 failed', str(result))
+		fs.close()
@@ -2,23 +2,7 @@ import os
 import sys
 import argparse
 from fatx import FATX
-from fatx.interface import FatxObject, DirectoryObject
-
-
-def walkfs(obj: FatxObject):
-    count = 0
-    for item in obj.ls():
-        if isinstance(item, DirectoryObject):
-            os.mkdir(str(item))
-            os.chdir(str(item))
-            count += walkfs(item)
-            os.chdir("..")
-        else:
-            f = open(str(item), "wb")
-            f.write(item.export())
-            f.close()
-            count += 1
-    return count
+from fatx.extract import extract
 
 
 if __name__ == "__main__":
@@ -32,6 +16,26 @@ if __name__ == "__main__":
         type=int,
         help="sector size used for this image(default: 512)",
     )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help="memory-map the image instead of reading it cluster by cluster",
+    )
+    parser.add_argument(
+        "--direct",
+        dest="direct",
+        action="store_true",
+        help="read with O_DIRECT, bypassing the page cache(for block devices)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        dest="jobs",
+        default=os.cpu_count(),
+        type=int,
+        help="number of files extracted in parallel(default: number of CPUs)",
+    )
     parser.add_argument(
         dest="image", type=str, nargs=1, action="store", help="an FATX filesystem image"
     )
@@ -48,11 +52,15 @@ if __name__ == "__main__":
     file = args.image[0]
     if not os.path.isdir(dest):
         sys.exit("Fatal: destination-dir is not a valid directory")
-    if not os.path.isfile(file):
+    # block devices are fine too
+    if not os.path.exists(file) or os.path.isdir(file):
         sys.exit("Fatal: fatx-image is not a valid file")
 
-    fs = FATX.Filesystem(file)
+    fs = FATX.Filesystem(file, args.sector_size, args.mmap, direct=args.direct)
     fs.status()
-    root = fs.root
-    os.chdir(dest)
-    print("Unpacked {0} files.".format(walkfs(root)))
+    failed = []
+    print("Unpacked {0} files.".format(extract(fs.root, dest, args.jobs, failed)))
+    for path, error in failed:
+        print("{0}: {1}".format(path, error), file=sys.stderr)
+    if failed:
+        sys.exit("Failed to unpack {0} files or folders".format(len(failed)))